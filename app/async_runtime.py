@@ -0,0 +1,295 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import aiohttp
+import paho.mqtt.client as mqtt
+from cache_manager import device_cache
+from client_channel import ClientChannel
+from client_manager import client_manager
+from codec import GetAnswers, Payload, accepts_gzip, dumps
+from diagnostics import diagnostics
+from config import (HTTP_DATA_PORT, HTTP_DEVICE_PORT, HTTP_MAX_WORKERS, HTTP_DEVICE_TIMEOUT,
+                    HTTP_DATA_TIMEOUT, HTTP_BATCH_MODE, HTTP_BATCH_MAX, DELIVERY_COALESCE_MS, DEVICE_LIST_DELTA,
+                    GET_ANSWER_WINDOW_MS, logger)
+from device_list_processor import last_device_lists
+from http_client import JSON_HEADERS, batch_body, client_timeout, list_key, list_request, register_channel_gauges
+from metrics import ENABLED as METRICS_ENABLED, delivery_errors, delivery_seconds
+from mqtt_handler import MQTTHandler, brokers
+from message_router import release_held
+from services import device_status_manager, get_response_cache
+from priority import HIGH, priority_rules
+from snapshot import state_snapshot
+from subscriptions import subscription_index
+
+class AsyncDelivery:
+    """Event-loop counterpart of pipeline + HTTPClient: same ClientChannel state, aiohttp transport.
+
+    submit() is called on the loop (from on_message) and never blocks; called from
+    another thread (client listeners on the clients.json watcher) it is handed to
+    the loop. Sends are tasks bounded by HTTP_MAX_WORKERS, retries are loop timers.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.channels: Dict[str, ClientChannel] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        self.limit = asyncio.Semaphore(HTTP_MAX_WORKERS)
+        self.window = max(0, DELIVERY_COALESCE_MS) / 1000.0
+        self.coalesced: 'OrderedDict[str, dict]' = OrderedDict()
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.answer_window = max(0, GET_ANSWER_WINDOW_MS) / 1000.0
+        self.answers: 'OrderedDict[str, dict]' = OrderedDict()
+        self.answer_handle: Optional[asyncio.TimerHandle] = None
+        client_manager.add_listener(self.on_client_registered)
+        client_manager.add_retire_listener(self.on_client_retired)
+
+    async def start(self):
+        # per-host pool of 2 keep-alive connections == one session per client
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=2, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector)
+        register_channel_gauges(self.stats)
+
+    async def close(self):
+        if self.session: await self.session.close()
+
+    def channel(self, ip: str) -> ClientChannel:
+        channel = self.channels.get(ip)
+        if channel is None:
+            channel = self.channels[ip] = ClientChannel(ip)
+        return channel
+
+    def on_client_registered(self, name: str, ip: str, old_ip: Optional[str]):
+        # may come from the clients.json watcher thread
+        self.loop.call_soon_threadsafe(self._client_registered, ip, old_ip)
+
+    def _client_registered(self, ip: str, old_ip: Optional[str]):
+        channel = self.channel(ip)
+        channel.reset()
+        self._kick(channel)
+
+    def on_client_retired(self, old_ip: str, new_ip: Optional[str]):
+        self.loop.call_soon_threadsafe(self._client_retired, old_ip, new_ip)
+
+    def _client_retired(self, old_ip: str, new_ip: Optional[str]):
+        # stop probing the old IP; what was waiting for it follows the client to its new one
+        timer = self.timers.pop(old_ip, None)
+        if timer: timer.cancel()
+        channel = self.channels.pop(old_ip, None)
+        if channel is None: return
+        channel.retired = True
+        entries = channel.take_all()
+        if new_ip and entries:
+            target = self.channel(new_ip)
+            for key, entry in entries: target.offer(key, entry)
+            self._kick(target)
+
+    def submit(self, data: Any, is_list: bool, ips: Optional[list] = None) -> bool:
+        try: running = asyncio.get_running_loop()
+        except RuntimeError: running = None
+        if running is not self.loop:
+            self.loop.call_soon_threadsafe(self.submit, data, is_list, ips)
+            return True
+        if is_list:
+            self._enqueue([(list_key(data), (HTTP_DATA_PORT, Payload(data, priority_rules.device_list), True))], ips)
+            return True
+        items = [i for i in (data if isinstance(data, list) else [data]) if isinstance(i, dict)]
+        if isinstance(data, GetAnswers) and ips is None:
+            # gathered for the answer window, then each client gets its share as one batch
+            for item in items:
+                key = str(item.get('avdevicename', ''))
+                self.coalesced.pop(key, None)
+                self.answers.pop(key, None)
+                self.answers[key] = item
+            if self.answer_handle is None:
+                self.answer_handle = self.loop.call_later(self.answer_window, self._flush_answers)
+            return True
+        if self.window and ips is None:
+            # high-priority events skip the coalescing window (and supersede what waits there)
+            high = priority_rules.of_items(items) == HIGH
+            for item in items:
+                key = str(item.get('avdevicename', ''))
+                self.coalesced.pop(key, None)
+                if not high: self.coalesced[key] = item
+            if not high:
+                if self.flush_handle is None:
+                    self.flush_handle = self.loop.call_later(self.window, self._flush)
+                return True
+        self._enqueue([(str(i.get('avdevicename', '')), (HTTP_DEVICE_PORT, Payload(i, priority_rules.of(i)), False)) for i in items], ips)
+        return True
+
+    def _flush(self):
+        self.flush_handle = None
+        items, self.coalesced = list(self.coalesced.values()), OrderedDict()
+        self._enqueue([(str(i.get('avdevicename', '')), (HTTP_DEVICE_PORT, Payload(i, priority_rules.of(i)), False)) for i in items])
+
+    def _flush_answers(self):
+        self.answer_handle = None
+        items, self.answers = list(self.answers.values()), OrderedDict()
+        self._enqueue([(str(i.get('avdevicename', '')), (HTTP_DEVICE_PORT, Payload(i, priority_rules.of(i), True), False)) for i in items])
+
+    def _enqueue(self, entries: List[tuple], ips: Optional[List[str]] = None):
+        for ip, mine in subscription_index.fan_out(entries, ips):
+            channel = self.channel(ip)
+            for key, entry in mine:
+                channel.offer(key, entry)
+            self._kick(channel)
+
+    def _kick(self, channel: ClientChannel):
+        if channel.retired: return
+        now = time.monotonic()
+        if channel.acquire(now):
+            self.loop.create_task(self._drain(channel))
+        elif channel.pending and not channel.busy and channel.ip not in self.timers:
+            self.timers[channel.ip] = self.loop.call_later(channel.retry_delay(now), self._on_timer, channel)
+
+    def _on_timer(self, channel: ClientChannel):
+        self.timers.pop(channel.ip, None)
+        self._kick(channel)
+
+    async def _drain(self, channel: ClientChannel):
+        batch_max = HTTP_BATCH_MAX if HTTP_BATCH_MODE == 'json' else 1
+        while True:
+            taken = channel.pop(batch_max)
+            # nothing left, or only rate-limited lanes: _kick sets the token timer
+            if not taken: return self._kick(channel)
+            port, data, is_list = taken[0][1]
+            started = time.perf_counter()
+            try:
+                async with self.limit:
+                    if is_list:
+                        body, headers = list_request(data, channel.gzip)
+                        channel.gzip = accepts_gzip(await self._get(channel.ip, port, HTTP_DATA_TIMEOUT, body=body, headers=headers))
+                    elif len(taken) == 1: await self._get(channel.ip, port, HTTP_DEVICE_TIMEOUT, query=data.query())
+                    else:
+                        body = dumps(batch_body([e[1].data for _, e in taken]))
+                        await self._get(channel.ip, port, HTTP_DEVICE_TIMEOUT, body=body, headers=JSON_HEADERS)
+                if channel.success() and DEVICE_LIST_DELTA:
+                    # back from an open circuit (its queue may have overflowed meanwhile): the full lists again
+                    for full in last_device_lists(): self.submit(full, True, ips=[channel.ip])
+                if METRICS_ENABLED:
+                    delivery_seconds.observe(time.perf_counter() - started, client=channel.ip, kind='list' if is_list else 'device')
+                if diagnostics.tracing: diagnostics.stage('deliver', time.perf_counter() - started)
+            except Exception as e:
+                if METRICS_ENABLED: delivery_errors.inc(client=channel.ip)
+                delay = channel.failure(taken, time.monotonic())
+                logger.error(f"HTTP küldési hiba ({'lista' if is_list else 'státusz'}) -> {channel.ip}: {e!r} (retry in {delay:.1f}s)")
+                if not channel.retired and channel.ip not in self.timers:
+                    self.timers[channel.ip] = self.loop.call_later(delay, self._on_timer, channel)
+                return
+
+    async def _get(self, ip: str, port: int, read_timeout: float, query: str = '', body: Optional[bytes] = None,
+                   headers: Optional[dict] = None):
+        connect, read = client_timeout(ip, read_timeout)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+        url = f"http://{ip}:{port}/" + (f"?{query}" if query else '')
+        async with self.session.get(url, timeout=timeout, data=body, headers=headers) as response:
+            await response.read()
+            return response.headers
+
+    def stats(self) -> Dict[str, dict]:
+        return {ip: c.stats() for ip, c in self.channels.items()}
+
+class AsyncioMQTT:
+    """Drives a paho client from the event loop instead of loop_forever().
+
+    connect() (DNS + TCP + CONNECT) runs in the default executor, so a broker
+    that is down never stalls the loop; the socket callbacks it fires there are
+    handed over to the loop.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, handler: MQTTHandler):
+        self.loop = loop
+        self.handler = handler
+        self.client = handler.client
+        self.misc_task = None
+        self.disconnected = asyncio.Event()
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.client.on_disconnect = lambda client, userdata, rc: self._on_loop(self.disconnected.set)
+
+    def _on_loop(self, fn, *args):
+        # paho calls back from connect() in the executor as well as from the loop
+        try: running = asyncio.get_running_loop()
+        except RuntimeError: running = None
+        if running is self.loop: fn(*args)
+        else: self.loop.call_soon_threadsafe(fn, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._socket_open, sock)
+
+    def _socket_open(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc_task = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._socket_close, sock)
+
+    def _socket_close(self, sock):
+        # deferred from the executor the socket may already be closed
+        try: self.loop.remove_reader(sock)
+        except (ValueError, OSError): pass
+        if self.misc_task: self.misc_task.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try: await asyncio.sleep(1)
+            except asyncio.CancelledError: break
+
+    async def run(self):
+        delay = 1
+        while True:
+            self.disconnected.clear()
+            try:
+                await self.loop.run_in_executor(None, self.client.connect, self.handler.broker.host, self.handler.broker.port, 60)
+                delay = 1
+                await self.disconnected.wait()
+                logger.warning(f"MQTT disconnected ({self.handler.broker.label}), reconnecting")
+            except Exception as e:
+                logger.error(f"MQTT connect error ({self.handler.broker.label}): {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+async def _periodic(interval: float, fn, *args):
+    while True:
+        await asyncio.sleep(interval)
+        try: fn(*args)
+        except Exception as e: logger.error(f"Periodic task error: {e}")
+
+def _cleanup(delivery: AsyncDelivery):
+    device_cache.cleanup()
+    device_status_manager.cleanup()
+    get_response_cache.cleanup()
+    logger.info(f"Caches: device {device_cache.cache.stats()}, get {get_response_cache.cache.stats()}")
+    logger.info(f"Client channels: {delivery.stats()}")
+
+def _release(handler: MQTTHandler):
+    data = release_held()
+    if data: handler.deliver(data, False, False)
+
+async def main():
+    loop = asyncio.get_running_loop()
+    delivery = AsyncDelivery(loop)
+    await delivery.start()
+    # one paho client per broker, all on this loop and feeding the same delivery
+    drivers = [AsyncioMQTT(loop, MQTTHandler(sink=delivery, broker=broker)) for broker in brokers()]
+    tasks = [loop.create_task(_periodic(300, _cleanup, delivery)),
+             loop.create_task(_periodic(1, _release, drivers[0].handler))]
+    if state_snapshot.enabled:
+        tasks.append(loop.create_task(_periodic(state_snapshot.interval, loop.run_in_executor, None, state_snapshot.save)))
+    try:
+        await asyncio.gather(*(driver.run() for driver in drivers))
+    finally:
+        for task in tasks: task.cancel()
+        await delivery.close()
+
+def run():
+    logger.info("Z2MQTT2HTTP asyncio runtime")
+    asyncio.run(main())
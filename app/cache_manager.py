@@ -1,48 +1,122 @@
-
 import time
-from typing import Dict
-from config import TIMEOUT_PENDING_MAINCACHE
+from typing import Dict, List
+from config import TIMEOUT_PENDING_MAINCACHE, CACHE_MAX_ENTRIES
+from expiring_cache import ExpiringCache
+from filter_policy import filter_policy
+from metrics import registry
+
+IDENTITY_KEYS = ('room', 'avdevicename', 'type')
+
+class SentState:
+    # last delivered item of a device, with per-property send time and direction;
+    # latest / seen_at: the last routed item, filtered or not (answers manual gets)
+    __slots__ = ('data', 'sent_at', 'prop_sent_at', 'direction', 'latest', 'seen_at')
+
+    def __init__(self, data: dict, now: float):
+        self.data = data
+        self.sent_at = now
+        self.prop_sent_at: Dict[str, float] = {}
+        self.direction: Dict[str, int] = {}
+        self.latest = data
+        self.seen_at = now
 
 class DeviceStatusCache:
-    def __init__(self):
-        self.cache: Dict[str, dict] = {}
-        self.timeout = TIMEOUT_PENDING_MAINCACHE
+    def __init__(self, timeout: float = TIMEOUT_PENDING_MAINCACHE, max_entries: int = CACHE_MAX_ENTRIES):
+        # expired entry == Force Sync: the next report goes out unfiltered
+        self.cache = ExpiringCache(timeout, max_entries)
+        self.timeout = timeout
+        # device -> when its rate-limited change may go out (release_held), if no later report carries it
+        self.held: Dict[str, float] = {}
             
     def should_filter_message(self, device_name: str, result_data: dict) -> bool:
-        if device_name not in self.cache: 
+        state = self.cache.get(device_name)
+        if state is None: 
             return False
-            
-        cached = self.cache[device_name]
-        # Force Sync
-        if time.time() - cached['timestamp'] > self.timeout: 
+
+        now = time.monotonic()
+        rules = filter_policy.rules_for(device_name, result_data.get('room'))
+        # Force Sync: max silence per device
+        if now - state.sent_at >= rules.max_silence:
             return False
-        
-        old_data = cached['data']
-        
-        # Extract vaalues
-        exact_keys = ['avnewstatus', 'brightness', 'battery', 'contact', 'occupancy']
-        for target_value in exact_keys:
-            if target_value in result_data and result_data.get(target_value) != old_data.get(target_value):
-                return False # Változott, ne szűrd (küldd el)
 
-        # 2. Filter 
-        analog_keys = ['temperature', 'humidity']
-        for target_value in analog_keys:
-            if target_value in result_data:
-                new_val = result_data.get(target_value)
-                old_val = old_data.get(target_value)
-                
-                if new_val is not None and old_val is not None:
-                    # (int(float(...))) I Keep what i need, only full integer changes
-                    if int(float(new_val)) != int(float(old_val)):
-                        return False 
-                elif new_val != old_val:
-                    return False
+        old_data = state.data
+        for key, new_val in result_data.items():
+            if key in IDENTITY_KEYS: continue
+            rule = rules.get(key)
+            if rule is None: continue
+            if rule.changed(old_data.get(key), new_val, state.direction.get(key, 0)):
+                # Változott, de rate limit alatt? -> a következő jelentéssel vagy release_held-del megy ki
+                due = state.prop_sent_at.get(key, 0.0) + rule.min_interval
+                if now < due:
+                    self.held[device_name] = min(self.held.get(device_name, due), due)
+                    continue
+                return False # Változott, ne szűrd (küldd el)
 
+        state.latest, state.seen_at = result_data, now
         return True # drop everything whats left
 
     def update(self, device_name: str, result_data: dict):
-        # save last data
-        self.cache[device_name] = {'timestamp': time.time(), 'data': result_data.copy()}
+        # save last data; routed items are never mutated after this point, no copy needed
+        now = time.monotonic()
+        old = self.cache.get(device_name)
+        state = SentState(result_data, now)
+        self.held.pop(device_name, None)
+        if old is not None:
+            state.prop_sent_at, state.direction = old.prop_sent_at, old.direction
+            for key, new_val in result_data.items():
+                old_val = old.data.get(key)
+                if key in IDENTITY_KEYS or old_val == new_val: continue
+                state.prop_sent_at[key] = now
+                try: state.direction[key] = 1 if float(new_val) > float(old_val) else -1
+                except (TypeError, ValueError): pass
+        else:
+            state.prop_sent_at = {k: now for k in result_data if k not in IDENTITY_KEYS}
+        self.cache.set(device_name, state)
+
+    def release_held(self) -> List[dict]:
+        # rate-limited changes whose min_interval is over: the latest report goes out if it still differs
+        now = time.monotonic()
+        released = []
+        for name, due in list(self.held.items()):
+            if due > now: continue
+            self.held.pop(name, None)
+            state = self.cache.get(name)
+            if state is not None and not self.should_filter_message(name, state.latest):
+                self.update(name, state.latest)
+                released.append(state.latest)
+        return released
+
+    def known_state(self, device_name: str, max_age: float) -> List[dict]:
+        # latest items of a device (and its l1/l2 endpoints) reported within max_age
+        if max_age <= 0: return []
+        now = time.monotonic()
+        names = (device_name,) if '/' in device_name else (device_name, f"{device_name}/l1", f"{device_name}/l2")
+        states = [self.cache.get(name) for name in names]
+        return [s.latest for s in states if s is not None and now - s.seen_at <= max_age]
+
+    def export(self) -> Dict[str, dict]:
+        """Cache contents with ages instead of monotonic stamps, for the snapshot file."""
+        now = time.monotonic()
+        return {name: {'data': state.data, 'age': now - state.sent_at,
+                       'prop_age': {k: now - t for k, t in state.prop_sent_at.items()},
+                       'direction': state.direction}
+                for name, state in self.cache.items()}
+
+    def restore(self, entries: Dict[str, dict], elapsed: float = 0.0) -> int:
+        now = time.monotonic()
+        restored = 0
+        for name, entry in entries.items():
+            age = entry['age'] + elapsed
+            if age >= self.timeout: continue
+            state = SentState(entry['data'], now - age)
+            state.prop_sent_at = {k: now - a - elapsed for k, a in entry.get('prop_age', {}).items()}
+            state.direction = entry.get('direction', {})
+            self.cache.set(name, state, ttl=self.timeout - age)
+            restored += 1
+        return restored
+
+    def cleanup(self):
+        self.cache.expire()
 
-device_cache = DeviceStatusCache()
\ No newline at end of file
+device_cache = DeviceStatusCache()
+registry.gauge('z2m_device_cache_entries', 'DeviceStatusCache entries', lambda: [({}, len(device_cache.cache))])
@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+from codec import Payload
+from config import (CLIENT_QUEUE_SIZE, CLIENT_BACKOFF_BASE, CLIENT_BACKOFF_MAX, CLIENT_BREAKER_THRESHOLD,
+                    CLIENT_BREAKER_COOLDOWN, CLIENT_RATE_LIMITS, HTTP_BATCH_MAX, logger)
+from device_list_processor import merge_device_lists
+from priority import LANES
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait(self, now: float) -> float:
+        # seconds until one request may go
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+def _buckets() -> List[Optional[TokenBucket]]:
+    limits = [CLIENT_RATE_LIMITS.get(lane) for lane in LANES]
+    return [TokenBucket(float(l[0]), float(l[1])) if l and float(l[0]) > 0 else None for l in limits]
+
+def _merged(older: tuple, newer: tuple) -> tuple:
+    # a device list replacing a pending one: delta pushes must not lose the older one's changes
+    if not (older[2] and newer[2]) or not newer[1].data.get('delta'): return newer
+    return newer[0], Payload(merge_device_lists(older[1].data, newer[1].data), newer[1].lane), True
+
+class ClientChannel:
+    """Delivery queue and health state of one client.
+
+    Pending entries are keyed per device, so while a client is unreachable only
+    the latest state of each device is kept and replayed once it is back. The
+    channel never has more than one send in flight; the driver (thread pool or
+    event loop) calls acquire -> pop -> success/failure. Entries are
+    (port, codec.Payload, is_list) tuples shared by all channels; device updates
+    for the same port can be popped together as one batch; /get answers
+    (Payload.answer) always are, with the other answers.
+
+    Each priority lane (Payload.lane) has its own queue: pop always serves the
+    most urgent lane first, and lanes with a token bucket (CLIENT_RATE_LIMITS)
+    wait for a token while more urgent traffic keeps flowing.
+    """
+    def __init__(self, ip: str, maxsize: int = CLIENT_QUEUE_SIZE):
+        self.ip = ip
+        self.maxsize = max(1, maxsize)
+        self.lanes: List['OrderedDict[Any, Any]'] = [OrderedDict() for _ in LANES]
+        self.buckets = _buckets()
+        self.busy = False
+        self.failures = 0
+        self.state = 'closed'
+        self.retry_at = 0.0
+        self.dropped = 0
+        self.sent = 0
+        self.errors = 0
+        self.gzip = False  # learned from the receiver's Accept-Encoding
+        self.retired = False  # no client uses this IP any more: nothing is scheduled for it
+        self.lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    def offer(self, key: Any, entry: Any):
+        with self.lock:
+            # latest value wins (device lists are merged), but it goes to the back of its lane
+            for lane in self.lanes:
+                older = lane.pop(key, None)
+                if older is not None: entry = _merged(older, entry)
+            if self.pending >= self.maxsize and not entry[2]:
+                # the oldest entry of the least urgent lane makes room, but never a more urgent one than this
+                # and never a device list (a lost delta would leave the client's list wrong for good)
+                self.dropped += 1
+                victim = next(((lane, k) for lane in reversed(self.lanes[entry[1].lane:])
+                               for k, e in lane.items() if not e[2]), None)
+                if victim is None: return
+                del victim[0][victim[1]]
+            self.lanes[entry[1].lane][key] = entry
+
+    def _ready(self, now: float) -> Optional[int]:
+        # most urgent lane with entries and a token
+        for index, lane in enumerate(self.lanes):
+            if lane and (self.buckets[index] is None or self.buckets[index].wait(now) == 0):
+                return index
+        return None
+
+    def acquire(self, now: float) -> bool:
+        with self.lock:
+            if self.busy or now < self.retry_at or self._ready(now) is None:
+                return False
+            self.busy = True
+            return True
+
+    def pop(self, batch_max: int = 1) -> List[Tuple[Any, Any]]:
+        with self.lock:
+            now = time.monotonic()
+            index = self._ready(now)
+            if index is None:
+                self.busy = False
+                return []
+            lane = self.lanes[index]
+            if self.buckets[index] is not None: self.buckets[index].take(now)
+            key, entry = lane.popitem(last=False)
+            taken = [(key, entry)]
+            answer = entry[1].answer
+            limit = max(batch_max, HTTP_BATCH_MAX) if answer else batch_max
+            if limit > 1 and not entry[2]:
+                for other in list(lane):
+                    if len(taken) >= limit: break
+                    port, payload, is_list = lane[other]
+                    if not is_list and port == entry[0] and (batch_max > 1 or payload.answer):
+                        taken.append((other, lane.pop(other)))
+            return taken
+
+    def success(self) -> bool:
+        # True when the client came back from an open circuit (the driver resends the full device lists)
+        with self.lock:
+            self.sent += 1
+            recovered = self.state == 'open'
+            if self.state != 'closed':
+                logger.info(f"Client {self.ip} reachable again, catching up {self.pending} pending update(s)")
+            self.failures = 0
+            self.state = 'closed'
+            self.retry_at = 0.0
+            return recovered
+
+    def failure(self, taken: List[Tuple[Any, Any]], now: float) -> float:
+        """Requeue the failed entries (unless newer ones arrived) and back off. Returns the delay."""
+        with self.lock:
+            self.errors += 1
+            for key, entry in reversed(taken):
+                lane = self.lanes[entry[1].lane]
+                newer = next((l for l in self.lanes if key in l), None)
+                if newer is None:
+                    lane[key] = entry
+                    lane.move_to_end(key, last=False)
+                else:
+                    # a newer list delta arrived meanwhile: it stands for both
+                    newer[key] = _merged(entry, newer[key])
+            self.failures += 1
+            if self.failures >= CLIENT_BREAKER_THRESHOLD:
+                if self.state == 'closed':
+                    logger.warning(f"Client {self.ip} unreachable, circuit open for {CLIENT_BREAKER_COOLDOWN}s")
+                self.state = 'open'
+                delay = CLIENT_BREAKER_COOLDOWN
+            else:
+                delay = min(CLIENT_BACKOFF_MAX, CLIENT_BACKOFF_BASE * 2 ** (self.failures - 1))
+            self.retry_at = now + delay
+            self.busy = False
+            return delay
+
+    def take_all(self) -> List[Tuple[Any, Any]]:
+        # every pending entry, most urgent lane first, for the channel of the client's new IP
+        with self.lock:
+            entries = [item for lane in self.lanes for item in lane.items()]
+            for lane in self.lanes: lane.clear()
+            return entries
+
+    def reset(self):
+        # client announced itself: probe right away instead of waiting out the backoff
+        with self.lock:
+            self.retry_at = 0.0
+
+    def retry_delay(self, now: float) -> float:
+        # backoff, or the soonest token of a rate-limited lane with entries
+        with self.lock:
+            waits = [self.buckets[i].wait(now) for i, lane in enumerate(self.lanes) if lane and self.buckets[i] is not None]
+        return max(self.retry_at - now, min(waits) if waits else 0.0, 0.0)
+
+    def stats(self) -> dict:
+        state = 'half_open' if self.state == 'open' and time.monotonic() >= self.retry_at else self.state
+        return {'state': state, 'pending': self.pending, 'lanes': [len(lane) for lane in self.lanes],
+                'failures': self.failures, 'sent': self.sent, 'errors': self.errors, 'dropped': self.dropped}
@@ -1,12 +1,91 @@
 import json
 import os
 import re
-from config import CLIENTS_DATA_FILE, logger
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, FrozenSet, Mapping, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs
+from config import CLIENTS_DATA_FILE, CLIENTS_SAVE_DELAY, CLIENTS_RELOAD_INTERVAL, CLIENT_SCOPES_FILE, logger
+from device_registry import EVENT_TYPES, TYPE_ALIASES
+
+IP_RE = re.compile(r'^(\d{1,3}\.){3}\d{1,3}$')
+
+class Scope(NamedTuple):
+    """What a client subscribed to. Rooms and types narrow each other, devices are always included."""
+    rooms: FrozenSet[str]
+    types: FrozenSet[str]
+    devices: FrozenSet[str]
+
+    @classmethod
+    def parse(cls, spec: Mapping[str, Any]) -> Optional['Scope']:
+        # {"rooms": [...] or "a,b", "types": ..., "devices": ...}; nothing listed = everything (None)
+        def names(key):
+            value = spec.get(key) or []
+            if isinstance(value, str): value = value.split(',')
+            return frozenset(str(v).strip() for v in value if str(v).strip())
+        # one vocabulary for events and list entries: the event types, device_type names map onto them
+        types = frozenset(TYPE_ALIASES.get(t, t) for t in names('types'))
+        if types - set(EVENT_TYPES):
+            # kept, so they match nothing instead of widening the scope
+            logger.warning(f"Unknown subscription type(s) {sorted(types - set(EVENT_TYPES))}, known: {', '.join(EVENT_TYPES)}")
+        scope = cls(names('rooms'), types, names('devices'))
+        return scope if any(scope) else None
+
+    def matches(self, room: Any, dtype: Any, device: str) -> bool:
+        if device in self.devices: return True
+        if not (self.rooms or self.types): return False
+        return (not self.rooms or room in self.rooms) and (not self.types or dtype in self.types)
+
+    def to_json(self) -> dict:
+        return {k: sorted(v) for k, v in self._asdict().items() if v}
+
+class ClientSnapshot(NamedTuple):
+    # immutable view of the registry; updates publish a new one
+    version: int
+    clients: Mapping[str, str]
+    ips: Tuple[str, ...]
+    scopes: Mapping[str, Scope]  # client name -> scope, unscoped clients are absent
 
 class ClientManager:
     def __init__(self):
         self.data_file = CLIENTS_DATA_FILE
-        self.clients = self._load()
+        self.scopes_file = CLIENT_SCOPES_FILE
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # one writer at a time, without blocking registrations
+        self.listeners = []
+        self.scope_listeners = []
+        self.retire_listeners = []
+        self.save_timer: Optional[threading.Timer] = None
+        self.file_mtime = self._mtime()
+        self.snapshot = ClientSnapshot(0, MappingProxyType({}), (), MappingProxyType({}))
+        self._publish(self._load(), self._load_scopes())
+
+    @property
+    def clients(self) -> Mapping[str, str]:
+        return self.snapshot.clients
+
+    def add_listener(self, callback):
+        # callback(name, ip, old_ip) on every registration, changed or not
+        self.listeners.append(callback)
+
+    def add_scope_listener(self, callback):
+        # callback(name, ip) when a client's subscription changed
+        self.scope_listeners.append(callback)
+
+    def add_retire_listener(self, callback):
+        # callback(old_ip, new_ip) when no client uses old_ip any more; new_ip: where its client moved, or None.
+        # Called before the registration listeners of the move.
+        self.retire_listeners.append(callback)
+
+    def _retire(self, moves: Mapping[str, Optional[str]]):
+        for old_ip, new_ip in moves.items():
+            for callback in self.retire_listeners:
+                callback(old_ip, new_ip)
+
+    def _mtime(self) -> Optional[float]:
+        try: return os.stat(self.data_file).st_mtime
+        except OSError: return None
 
     def _load(self) -> dict:
         if os.path.exists(self.data_file):
@@ -17,29 +96,133 @@ class ClientManager:
                 logger.error(f"Error loading clients.json: {e}")
         return {}
 
-    def _save(self):
+    def _load_scopes(self) -> dict:
+        if not os.path.exists(self.scopes_file): return {}
         try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.clients, f, indent=2)
+            with open(self.scopes_file, 'r') as f:
+                specs = json.load(f)
+            return {name: scope for name, scope in ((n, Scope.parse(s)) for n, s in specs.items()) if scope}
         except Exception as e:
-            logger.error(f"Error saving clients.json: {e}")
+            logger.error(f"Error loading {self.scopes_file}: {e}")
+            return {}
+
+    def _publish(self, clients: dict, scopes: Optional[dict] = None):
+        # readers hold on to whatever snapshot they started with
+        scopes = self.snapshot.scopes if scopes is None else MappingProxyType(scopes)
+        self.snapshot = ClientSnapshot(self.snapshot.version + 1, MappingProxyType(clients),
+                                       tuple(dict.fromkeys(clients.values())), scopes)
+
+    def _schedule_save(self):
+        # write-behind: a burst of registrations costs one write, off the MQTT thread
+        with self.lock:
+            if self.save_timer is not None: return
+            self.save_timer = threading.Timer(CLIENTS_SAVE_DELAY, self._save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def _save(self):
+        with self.save_lock:
+            # the snapshot is immutable: taken under the lock, written outside it (latest one wins)
+            with self.lock:
+                self.save_timer = None
+                snapshot = self.snapshot
+            try:
+                self._write(self.data_file, dict(snapshot.clients))
+                mtime = self._mtime()
+                with self.lock: self.file_mtime = mtime
+                if snapshot.scopes or os.path.exists(self.scopes_file):
+                    self._write(self.scopes_file, {n: s.to_json() for n, s in snapshot.scopes.items()})
+            except Exception as e:
+                logger.error(f"Error saving clients.json: {e}")
+
+    def _write(self, path: str, data: dict):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+    def flush(self):
+        with self.lock:
+            timer, self.save_timer = self.save_timer, None
+        if timer is not None:
+            timer.cancel()
+            self._save()
 
     def update_from_mqtt(self, payload_str: str):
+        # name/ip, optionally name/ip?rooms=a,b&types=x&devices=y to (re)declare the subscription
         try:
             if '/' not in payload_str: return
             name, ip = payload_str.split('/', 1)
+            ip, _, query = ip.partition('?')
             name, ip = name.strip(), ip.strip()
-            
-            if not re.match(r'^(\d{1,3}\.){3}\d{1,3}$', ip): return
 
-            if self.clients.get(name) != ip:
-                self.clients[name] = ip
+            if not IP_RE.match(ip): return
+
+            with self.lock:
+                old_ip = self.snapshot.clients.get(name)
+                if old_ip != ip:
+                    self._publish({**self.snapshot.clients, name: ip})
+                retired = old_ip and old_ip != ip and old_ip not in self.snapshot.ips
+            if old_ip != ip:
                 logger.info(f"Client data : {name} -> {ip}")
-                self._save()
+                self._schedule_save()
+            if retired: self._retire({old_ip: ip})
+            for callback in self.listeners:
+                callback(name, ip, old_ip)
+            if query.strip():
+                self.set_scope(name, {k: v[-1] for k, v in parse_qs(query.strip()).items()})
         except Exception as e:
             logger.error(f"Client update error: {e}")
 
-    def get_all_ips(self) -> list:
-        return list(self.clients.values())
+    def update_scope_from_mqtt(self, payload_str: str):
+        # client/subscribe: {"name": ..., "rooms": [...], "types": [...], "devices": [...]}, empty lists = everything
+        try:
+            spec = json.loads(payload_str)
+            if isinstance(spec, dict) and spec.get('name'): self.set_scope(str(spec['name']), spec)
+        except Exception as e:
+            logger.error(f"Client subscription error: {e}")
+
+    def set_scope(self, name: str, spec: Mapping[str, Any]):
+        scope = Scope.parse(spec)
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot.scopes.get(name) == scope: return
+            scopes = {n: s for n, s in snapshot.scopes.items() if n != name}
+            if scope: scopes[name] = scope
+            self._publish(dict(snapshot.clients), scopes)
+            ip = snapshot.clients.get(name)
+        logger.info(f"Client scope : {name} -> {scope.to_json() if scope else 'everything'}")
+        self._schedule_save()
+        if ip:
+            for callback in self.scope_listeners:
+                callback(name, ip)
+
+    def reload_if_changed(self):
+        mtime = self._mtime()
+        if mtime is None or mtime == self.file_mtime: return
+        clients = self._load()
+        with self.lock:
+            self.file_mtime = mtime
+            old = self.snapshot.clients
+            self._publish(clients)
+            ips = self.snapshot.ips
+        logger.info(f"clients.json changed on disk, reloaded ({len(clients)} client(s))")
+        # IPs nobody uses any more: moved with their client, or gone with it
+        self._retire({old_ip: clients.get(name) for name, old_ip in old.items() if old_ip not in ips})
+        for name, ip in clients.items():
+            if old.get(name) != ip:
+                for callback in self.listeners:
+                    callback(name, ip, old.get(name))
+
+    def start_watcher(self):
+        def watch():
+            while True:
+                time.sleep(CLIENTS_RELOAD_INTERVAL)
+                try: self.reload_if_changed()
+                except Exception as e: logger.error(f"Client reload error: {e}")
+        threading.Thread(target=watch, name='clients-watch', daemon=True).start()
+
+    def get_all_ips(self) -> Tuple[str, ...]:
+        return self.snapshot.ips
 
 client_manager = ClientManager()
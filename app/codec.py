@@ -0,0 +1,71 @@
+import gzip
+import json
+from typing import Any, Optional
+from urllib.parse import urlencode
+from config import JSON_BACKEND, HTTP_GZIP_MIN_BYTES, logger
+from priority import NORMAL
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if JSON_BACKEND == 'orjson' and orjson is None:
+    logger.warning("JSON_BACKEND=orjson but orjson is not installed, using stdlib json")
+USE_ORJSON = orjson is not None and JSON_BACKEND in ('auto', 'orjson')
+
+def loads(raw: Any) -> Any:
+    # bytes straight from paho, no intermediate str
+    return orjson.loads(raw) if USE_ORJSON else json.loads(raw)
+
+def dumps(obj: Any) -> bytes:
+    if USE_ORJSON: return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
+def encode_query(item: dict) -> str:
+    # same encoding requests applies to params=: None values are left out
+    return urlencode([(k, v) for k, v in item.items() if v is not None])
+
+class GetAnswers(list):
+    """route_message result answering manual /get requests.
+
+    The sinks gather answers for GET_ANSWER_WINDOW_MS and send a client every
+    answer pending for it as one batch request, whatever HTTP_BATCH_MODE is.
+    """
+
+class Payload:
+    """One routed event on its way to every client.
+
+    The same object is queued on all client channels, so the JSON body, query
+    string and gzipped body are built at most once, on first use. lane is the
+    priority lane (priority.HIGH / NORMAL / BULK) it is queued in; answer marks
+    a /get answer, batched with the other answers of the client.
+    """
+    __slots__ = ('data', 'lane', 'answer', '_body', '_query', '_gzipped')
+
+    def __init__(self, data: Any, lane: int = NORMAL, answer: bool = False):
+        self.data = data
+        self.lane = lane
+        self.answer = answer
+        self._body: Optional[bytes] = None
+        self._query: Optional[str] = None
+        self._gzipped: Optional[bytes] = None
+
+    def body(self) -> bytes:
+        if self._body is None: self._body = dumps(self.data)
+        return self._body
+
+    def query(self) -> str:
+        if self._query is None: self._query = encode_query(self.data)
+        return self._query
+
+    def compressible(self) -> bool:
+        return 0 < HTTP_GZIP_MIN_BYTES <= len(self.body())
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None: self._gzipped = gzip.compress(self.body(), compresslevel=5)
+        return self._gzipped
+
+def accepts_gzip(headers: Any) -> bool:
+    # receivers advertise request-body codings with Accept-Encoding on their responses (RFC 7694)
+    return 'gzip' in (headers.get('Accept-Encoding') or '').lower()
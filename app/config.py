@@ -1,27 +1,118 @@
 import os
+import json
 import logging
 import sys
 
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(
     stream=sys.stdout,
-    level=getattr(logging, LOG_LEVEL, logging.DEBUG),
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger("z2mqtt2http")
+# hot-path debug lines check this before formatting anything
+LOG_DEBUG = logger.isEnabledFor(logging.DEBUG)
+
+# On-demand diagnostics (SIGUSR1 toggles, or a client/diag message): profile + per-message stage trace.
+# profiler: sample (all threads, every DIAG_SAMPLE_MS) | cprofile (deterministic, MQTT thread only) | off
+DIAG_SECONDS = float(os.getenv('DIAG_SECONDS', 30))
+DIAG_PROFILER = os.getenv('DIAG_PROFILER', 'sample').lower()
+DIAG_SAMPLE_MS = float(os.getenv('DIAG_SAMPLE_MS', 5))
+DIAG_TOP = int(os.getenv('DIAG_TOP', 25))
+DIAG_DIR = os.getenv('DIAG_DIR') or '.'
+
+# Prometheus text endpoint (0 = off, no instrumentation cost)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# threads (paho loop_forever + delivery threads) | asyncio (single event loop, aiohttp delivery)
+RUNTIME = os.getenv('RUNTIME', 'threads').lower()
+# threads runtime only: route state messages in N worker processes sharded by device (0/1 = in-process)
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 0))
 
 MQTT_BROKER = os.getenv('MQTT_BROKER', '172.30.10.222')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 52888))
 MQTT_USERNAME = os.getenv('MQTT_USER', None)
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', None)
 MQTT_TOPIC = os.getenv('MQTT_TOPIC', 'gtl')
+# Several brokers / bridges in one process: JSON list of {"host", "port", "user", "password", "topic",
+# "namespace", "clients"}; missing fields fall back to the settings above, [] = just that one broker.
+# namespace prefixes device names (ns:device), default: none on the clients broker, the entry index on the others;
+# clients = listen to client/* there
+MQTT_BROKERS = json.loads(os.getenv('MQTT_BROKERS', '[]') or '[]')
+# devices: subscribe to bridge/devices and the topics of forwarded devices only, following the device list
+# all: TOPIC/# (devices missing from the list are routed by guessing from the payload)
+MQTT_SUBSCRIBE = os.getenv('MQTT_SUBSCRIBE', 'devices').lower()
 
 HTTP_DEVICE_PORT = int(os.getenv('HTTP_DEVICE_PORT', 1905))
 HTTP_DATA_PORT = int(os.getenv('HTTP_DATA_PORT', 1904))
 
+# Delivery engine: parallel fan-out, one keep-alive session per client
+HTTP_MAX_WORKERS = int(os.getenv('HTTP_MAX_WORKERS', 8))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_DEVICE_TIMEOUT = float(os.getenv('HTTP_DEVICE_TIMEOUT', 10))
+HTTP_DATA_TIMEOUT = float(os.getenv('HTTP_DATA_TIMEOUT', 15))
+# {"10.10.40.5": 5} -> per-client timeout override (seconds)
+HTTP_CLIENT_TIMEOUTS = json.loads(os.getenv('HTTP_CLIENT_TIMEOUTS', '{}') or '{}')
+
+# MQTT -> HTTP hand-off queue (drop_oldest | drop_newest | latest_wins)
+DELIVERY_QUEUE_SIZE = int(os.getenv('DELIVERY_QUEUE_SIZE', 1000))
+DELIVERY_OVERFLOW_POLICY = os.getenv('DELIVERY_OVERFLOW_POLICY', 'latest_wins').lower()
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 2))
+# Per-device coalescing window (latest value wins), 0 = off
+DELIVERY_COALESCE_MS = int(os.getenv('DELIVERY_COALESCE_MS', 50))
+# Device updates per request on HTTP_DEVICE_PORT: off = one query-param request per device,
+# json = pending updates of a client go out as one GET with a JSON batch body (/get answers always are)
+HTTP_BATCH_MODE = os.getenv('HTTP_BATCH_MODE', 'off').lower()
+HTTP_BATCH_MAX = int(os.getenv('HTTP_BATCH_MAX', 50))
+# auto = orjson if installed, else stdlib json
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto').lower()
+# gzip JSON bodies at least this large for receivers that advertise it (Accept-Encoding on their responses), 0 = off
+HTTP_GZIP_MIN_BYTES = int(os.getenv('HTTP_GZIP_MIN_BYTES', 0))
+
+# Delivery priority lanes (high | normal | bulk), JSON {"types": {...}, "properties": {...}, "device_list": ...}
+# merged over the defaults in priority.py
+PRIORITY_RULES = json.loads(os.getenv('PRIORITY_RULES', '{}') or '{}')
+# Per-client token buckets per lane, JSON {"bulk": [requests per second, burst]}, {} = unlimited
+CLIENT_RATE_LIMITS = json.loads(os.getenv('CLIENT_RATE_LIMITS', '{}') or '{}')
+
+# Per-client delivery queue, retry backoff and circuit breaker
+CLIENT_QUEUE_SIZE = int(os.getenv('CLIENT_QUEUE_SIZE', 200))
+CLIENT_BACKOFF_BASE = float(os.getenv('CLIENT_BACKOFF_BASE', 1))
+CLIENT_BACKOFF_MAX = float(os.getenv('CLIENT_BACKOFF_MAX', 30))
+CLIENT_BREAKER_THRESHOLD = int(os.getenv('CLIENT_BREAKER_THRESHOLD', 3))
+CLIENT_BREAKER_COOLDOWN = float(os.getenv('CLIENT_BREAKER_COOLDOWN', 60))
+
+# Device list pushes: 1 = after the first full list only added/changed/removed devices are sent
+DEVICE_LIST_DELTA = os.getenv('DEVICE_LIST_DELTA', '0').lower() in ('1', 'true', 'yes')
+
 TIMEOUT_PENDING_MAINCACHE = int(os.getenv('TIMEOUT_PENDING_MAINCACHE', 604800))
+# Filter policy (per property / room / device deadbands), see filter_policy.py
+FILTER_POLICY_FILE = os.getenv('FILTER_POLICY_FILE', '')
+# a change within min_interval of the last one is held back and goes out when the interval is over
+FILTER_MIN_INTERVAL = float(os.getenv('FILTER_MIN_INTERVAL', 0))
+FILTER_MAX_SILENCE = float(os.getenv('FILTER_MAX_SILENCE', TIMEOUT_PENDING_MAINCACHE))
 TIMEOUT_PENDING_GETREQUEST = int(os.getenv('TIMEOUT_PENDING_GETREQUEST', 5))
+TIMEOUT_PENDING_STATUS = int(os.getenv('TIMEOUT_PENDING_STATUS', 30))
+# manual /get answered at once from the last state reported within this many seconds (0 = always wait for the device)
+GET_ANSWER_MAX_AGE = float(os.getenv('GET_ANSWER_MAX_AGE', 300))
+# /get answers are gathered this long and go out as one batch request per client (any HTTP_BATCH_MODE), 0 = at once
+GET_ANSWER_WINDOW_MS = int(os.getenv('GET_ANSWER_WINDOW_MS', 50))
+# Upper bound per cache, least recently used entries are evicted first (0 = unbounded)
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 5000))
 CLIENTS_DATA_FILE = os.getenv('CLIENTS_DATA_FILE', 'clients.json')
+CLIENTS_SAVE_DELAY = float(os.getenv('CLIENTS_SAVE_DELAY', 2))
+CLIENTS_RELOAD_INTERVAL = float(os.getenv('CLIENTS_RELOAD_INTERVAL', 5))
+# Per-client subscriptions (rooms / types / devices), next to clients.json by default
+CLIENT_SCOPES_FILE = os.getenv('CLIENT_SCOPES_FILE') or os.path.join(os.path.dirname(CLIENTS_DATA_FILE), 'client_scopes.json')
+
+# Warm restart: gzipped JSON snapshot of the caches ('' = off), retained-message warm-up window
+STATE_SNAPSHOT_FILE = os.getenv('STATE_SNAPSHOT_FILE', '')
+STATE_SNAPSHOT_INTERVAL = float(os.getenv('STATE_SNAPSHOT_INTERVAL', 300))
+WARMUP_SECONDS = float(os.getenv('WARMUP_SECONDS', 10))
+# Traffic recorder: every received message appended to RECORD_FILE (binary, see recorder.py), '' = off
+RECORD_FILE = os.getenv('RECORD_FILE', '')
+RECORD_MAX_MB = float(os.getenv('RECORD_MAX_MB', 64))
+RECORD_KEEP = int(os.getenv('RECORD_KEEP', 5))
 
 ALLOWED_ROOMS = []
 
@@ -1,8 +1,24 @@
 import re
+import json
+import hashlib
 import logging
+from collections import Counter
 from datetime import datetime
-from typing import Optional, Dict, Any, List
-from config import update_allowed_rooms, logger
+from typing import Callable, Optional, Dict, Any, List, Tuple
+from config import DEVICE_LIST_DELTA, LOG_DEBUG, update_allowed_rooms, logger
+from device_registry import TYPE_ALIASES, device_registry, event_types
+from topics import namespace
+
+FRIENDLY_NAME_RE = re.compile(r'^([^\/]+)\/([^\/]+)\/(.+)$')
+FINGERPRINT_KEYS = ('friendly_name', 'supported', 'type', 'state', 'brightness', 'color', 'color_temp', 'color_mode',
+                    'temperature', 'humidity', 'pressure', 'illuminance', 'contact', 'occupancy', 'battery',
+                    'voltage', 'power', 'energy', 'current', 'state_l1', 'state_l2', 'brightness_l1', 'brightness_l2')
+
+# per bridge topic: friendly_name -> (fingerprint, dev_data), and the fingerprint of the whole list
+_device_state: Dict[str, Dict[str, Tuple[str, dict]]] = {}
+_list_fingerprints: Dict[str, str] = {}
+_last_full: Dict[str, dict] = {}
+MISSING = object()
 
 def _extract_device_parameters(device: dict, endpoints: list) -> Dict[str, Any]:
     # Extract device parameters
@@ -41,13 +57,58 @@ def _map_device_type(zigbee_type: str, device_data: dict, device_parameters: dic
     if any(k in device_parameters for k in ['power', 'energy']): return 'smart_plug'
     return 'sensor' if zigbee_type == 'EndDevice' else 'switch'
 
+def _fingerprint(device: dict) -> str:
+    # only the fields the device entry is built from
+    definition = device.get('definition') or {}
+    relevant = [device.get(k) for k in FINGERPRINT_KEYS] + [definition.get('exposes')]
+    return hashlib.blake2b(json.dumps(relevant, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+def _build_device(device: dict, room: str, prefix: str = '') -> dict:
+    friendly_name = device['friendly_name']
+    # Get Endpoints 
+    endpoints = []
+    if device.get('definition') and device['definition'].get('exposes'):
+        endpoints = [
+            {
+                'endpoint': e.get('endpoint'), 
+                'type': e.get('type', 'unknown'),
+                'features': [f.get('name') or f.get('property') for f in e.get('features', [])]
+            }
+            for e in device['definition']['exposes'] if e.get('endpoint') and e.get('features')
+        ]
+    
+    device_parameters = _extract_device_parameters(device, endpoints)
+    device_type = _map_device_type(device.get('type', 'Router'), device, device_parameters)
+    
+    # set data 
+    dev_data = {
+        'room': room,
+        'name': f"{prefix}{friendly_name}", 
+        'device_type': device_type,
+        'zigbee_type': device.get('type', 'Router'),
+        'parameters': device_parameters,
+        'endpoints': endpoints,
+        'endpoint_count': len(endpoints),
+        'is_main_device': True,
+        # the 'type' of this device's events; subscriptions match list entries by these
+        'event_types': list(event_types(device)) or [TYPE_ALIASES.get(device_type, device_type)]
+    }
+    return dev_data
+
 def process_device_list(payload: Any, topic: str) -> Optional[Dict[str, Any]]:
     # to match tasker preferences
     if not isinstance(payload, list):
         return None
     
+    known = _device_state.get(topic, {})
+    bridge = topic[:-len('/bridge/devices')]
+    # names carry the bridge's namespace like the events' avdevicename (ns:...)
+    prefix = f"{namespace(topic)}:" if namespace(topic) else ''
+    current: Dict[str, Tuple[str, dict]] = {}
     devices = []
     discovered_rooms = set()
+    changed = []
+    changed_raw = {}
     
     for device in payload:
         # keep only recognized devices
@@ -56,59 +117,129 @@ def process_device_list(payload: Any, topic: str) -> Optional[Dict[str, Any]]:
             
         # Friendly name : gtl/szoba/eszkoznev  topic/room/devicename
         friendly_name = device['friendly_name']
-        match = re.match(r'^([^\/]+)\/([^\/]+)\/(.+)$', friendly_name)
+        match = FRIENDLY_NAME_RE.match(friendly_name)
         
         if match:
             room = match.group(2)
             discovered_rooms.add(room)
-            
-            # Get Endpoints 
-            endpoints = []
-            if device.get('definition') and device['definition'].get('exposes'):
-                endpoints = [
-                    {
-                        'endpoint': e.get('endpoint'), 
-                        'type': e.get('type', 'unknown'),
-                        'features': [f.get('name') or f.get('property') for f in e.get('features', [])]
-                    }
-                    for e in device['definition']['exposes'] if e.get('endpoint') and e.get('features')
-                ]
-            
-            device_parameters = _extract_device_parameters(device, endpoints)
-            device_type = _map_device_type(device.get('type', 'Router'), device, device_parameters)
-            
-            # set data 
-            dev_data = {
-                'room': room,
-                'name': friendly_name, 
-                'device_type': device_type,
-                'zigbee_type': device.get('type', 'Router'),
-                'parameters': device_parameters,
-                'endpoints': endpoints,
-                'endpoint_count': len(endpoints),
-                'is_main_device': True
-            }
+            fingerprint = _fingerprint(device)
+            cached = known.get(friendly_name)
+            if cached and cached[0] == fingerprint:
+                dev_data = cached[1]
+            else:
+                # new or changed device: only these entries are rebuilt
+                dev_data = _build_device(device, room, prefix)
+                changed.append(dev_data)
+                changed_raw[friendly_name] = device
+            current[friendly_name] = (fingerprint, dev_data)
             devices.append(dev_data)
         else:
             # Controlled devices without matching name preferenc
-            logger.debug(f"Device skipped or partially processed (regex mismatch): {friendly_name}")
+            if LOG_DEBUG: logger.debug(f"Device skipped or partially processed (regex mismatch): {friendly_name}")
+
+    removed = [name for name in known if name not in current]
+    list_fingerprint = hashlib.blake2b(''.join(f"{n}:{fp[0]};" for n, fp in current.items()).encode(), digest_size=16).hexdigest()
+    _device_state[topic] = current
+    if changed_raw or removed:
+        device_registry.update(topic, changed_raw, removed)
+    unchanged = _list_fingerprints.get(topic) == list_fingerprint
+    if unchanged and topic in _last_full:
+        logger.debug(f"Device list unchanged ({topic}), push skipped")
+        return None
+    _list_fingerprints[topic] = list_fingerprint
 
     if discovered_rooms:
         update_allowed_rooms(list(discovered_rooms))
     
     # device summary 
-    summary = {
-        'by_room': {r: sum(1 for d in devices if d['room'] == r) for r in discovered_rooms},
-        'by_device_type': {t: sum(1 for d in devices if d['device_type'] == t) for t in set(d['device_type'] for d in devices)},
-        'rooms': list(discovered_rooms)
-    }
+    summary = _summary(devices, list(discovered_rooms))
 
     # json
     result_data = {
         'timestamp': datetime.now().isoformat(),
+        'bridge': bridge,
         'devices': devices,
         'total_devices': len(devices),
         'summary': summary
     }
+    first_push = topic not in _last_full
+    _last_full[topic] = result_data
+    if unchanged:
+        # same list as in the restored snapshot: rebuilt locally, clients already have it
+        logger.debug(f"Device list matches snapshot ({topic}), push skipped")
+        return None
+
+    if DEVICE_LIST_DELTA and not first_push:
+        # only what changed since the previous push
+        added_names = {f"{prefix}{n}" for n in current if n not in known}
+        return {
+            'timestamp': result_data['timestamp'],
+            'bridge': bridge,
+            'delta': True,
+            'added': [d for d in changed if d['name'] in added_names],
+            'changed': [d for d in changed if d['name'] not in added_names],
+            'removed': [f"{prefix}{name}" for name in removed],
+            'total_devices': len(devices),
+            'summary': summary
+        }
     
-    return result_data
\ No newline at end of file
+    return result_data
+
+def _summary(devices: List[dict], rooms: List[str]) -> Dict[str, Any]:
+    return {
+        'by_room': dict(Counter(d['room'] for d in devices)),
+        'by_device_type': dict(Counter(d['device_type'] for d in devices)),
+        'rooms': rooms
+    }
+
+def trim_device_list(data: Dict[str, Any], keep: Callable[[dict], bool]) -> Dict[str, Any]:
+    """Copy of a device-list push with only the devices keep(dev_data) accepts (per-client scope)."""
+    if data.get('delta'):
+        # removed devices are only names: they are kept, a client ignores what it never had
+        return {**data, 'added': [d for d in data['added'] if keep(d)], 'changed': [d for d in data['changed'] if keep(d)]}
+    devices = [d for d in data['devices'] if keep(d)]
+    rooms = list(dict.fromkeys(d['room'] for d in devices))
+    return {**data, 'devices': devices, 'total_devices': len(devices), 'summary': _summary(devices, rooms)}
+
+def merge_device_lists(older: Any, newer: Any) -> Any:
+    """One pending push standing for two, when a queued list is replaced before it went out.
+
+    A full list is simply replaced, but a delta on top of anything keeps the
+    older push's changes: full + delta = full list, delta + delta = one delta.
+    """
+    if not isinstance(older, dict) or not isinstance(newer, dict) or not newer.get('delta'):
+        return newer
+    if not older.get('delta'):
+        devices = {d['name']: d for d in older['devices']}
+        for name in newer['removed']: devices.pop(name, None)
+        for d in newer['added'] + newer['changed']: devices[d['name']] = d
+        merged = list(devices.values())
+        rooms = list(dict.fromkeys(d['room'] for d in merged))
+        return {**older, 'timestamp': newer['timestamp'], 'devices': merged, 'total_devices': len(merged),
+                'summary': _summary(merged, rooms)}
+    added = {d['name']: d for d in older['added']}
+    changed = {d['name']: d for d in older['changed']}
+    removed = dict.fromkeys(older['removed'])
+    for name in newer['removed']:
+        # added and removed before it went out: the client never had it
+        if added.pop(name, None) is None:
+            changed.pop(name, None)
+            removed[name] = None
+    for d in newer['added']:
+        # removed and back again: the client still has the old entry
+        if removed.pop(d['name'], MISSING) is not MISSING: changed[d['name']] = d
+        else: added[d['name']] = d
+    for d in newer['changed']:
+        if d['name'] in added: added[d['name']] = d
+        else: changed[d['name']] = d
+    return {**newer, 'added': list(added.values()), 'changed': list(changed.values()), 'removed': list(removed)}
+
+def export_fingerprints() -> Dict[str, str]:
+    return dict(_list_fingerprints)
+
+def restore_fingerprints(fingerprints: Dict[str, str]):
+    _list_fingerprints.update(fingerprints)
+
+def last_device_lists() -> List[Dict[str, Any]]:
+    """Last full device list of every bridge topic (for clients joining in delta mode)."""
+    return list(_last_full.values())
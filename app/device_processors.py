@@ -1,12 +1,13 @@
 import logging
 from typing import Dict, Any, Optional, Union, List
+from topics import split_topic
 
 logger = logging.getLogger(__name__)
 
 def process_light_dimmer(topic: str, payload: Dict[str, Any]) -> Optional[Union[Dict, List[Dict]]]:
     # only if "brightness" is present 
     try:
-        topic_parts = topic.split('/')
+        topic_parts = split_topic(topic)
         if len(topic_parts) < 4 or topic_parts[-1] == 'set':
             return None
         
@@ -55,7 +56,7 @@ def process_power_switch(topic: str, payload: Any) -> Optional[Union[Dict, List[
     if not isinstance(payload, dict):
         return None
     
-    topic_parts = topic.split('/')
+    topic_parts = split_topic(topic)
     if len(topic_parts) < 4 or topic_parts[-1] == 'set':
         return None
     
@@ -83,7 +84,7 @@ def process_sensor_data(topic: str, payload: Any) -> Optional[Dict]:
     if not isinstance(payload, dict):
         return None
     
-    topic_parts = topic.split('/')
+    topic_parts = split_topic(topic)
     if len(topic_parts) < 4:
         return None
     
@@ -0,0 +1,110 @@
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from device_processors import process_light_dimmer, process_power_switch, process_sensor_data
+from topics import split_topic
+
+# (handler, keys selecting it, keys a payload must carry to be routed), first match wins
+ROUTES = (
+    (process_light_dimmer, ('brightness', 'brightness_l1', 'brightness_l2'),
+     ('brightness', 'brightness_l1', 'brightness_l2', 'state', 'state_l1', 'state_l2')),
+    (process_power_switch, ('state', 'state_l1', 'state_l2'), ('state', 'state_l1', 'state_l2')),
+    (process_sensor_data, ('humidity', 'temperature', 'contact', 'occupancy'),
+     ('humidity', 'temperature', 'contact', 'occupancy')),
+)
+
+Route = Tuple[Optional[Callable], Tuple[str, ...]]
+
+# subscription "types" are event 'type' values; device-list device_type names are accepted as aliases
+EVENT_TYPES = ('light_dimmer', 'power_switch', 'sensor', 'contact', 'motion')
+TYPE_ALIASES = {'dimmer': 'light_dimmer', 'rgb_light': 'light_dimmer', 'switch': 'power_switch',
+                'smart_plug': 'power_switch', 'temperature_sensor': 'sensor', 'contact_sensor': 'contact',
+                'motion_sensor': 'motion'}
+SENSOR_TYPES = (('sensor', ('humidity', 'temperature')), ('contact', ('contact',)), ('motion', ('occupancy',)))
+
+def _exposed_properties(device: dict) -> set:
+    properties = set()
+    for expose in (device.get('definition') or {}).get('exposes') or []:
+        if expose.get('property'): properties.add(expose['property'])
+        for feature in expose.get('features') or []:
+            if feature.get('property'): properties.add(feature['property'])
+    return properties
+
+def compile_route(device: dict) -> Route:
+    properties = _exposed_properties(device)
+    for handler, selectors, keys in ROUTES:
+        if any(k in properties for k in selectors):
+            return handler, tuple(k for k in keys if k in properties)
+    # known device without anything we forward
+    return None, ()
+
+def event_types(device: dict) -> Tuple[str, ...]:
+    # the event 'type' values the device's reports are routed to
+    handler, keys = compile_route(device)
+    if handler is process_light_dimmer: return ('light_dimmer',)
+    if handler is process_power_switch: return ('power_switch',)
+    if handler is process_sensor_data: return tuple(t for t, props in SENSOR_TYPES if any(k in keys for k in props))
+    return ()
+
+def device_topics(topic: str, device: dict, route: Route) -> Tuple[str, ...]:
+    # what a forwarded device publishes that we route: state, /get requests, l1/l2 endpoint states and their /get
+    if route[0] is None: return ()
+    exposes = (device.get('definition') or {}).get('exposes') or []
+    endpoints = sorted({e.get('endpoint') for e in exposes if e.get('endpoint') in ('l1', 'l2')})
+    return (topic, f"{topic}/get") + tuple(t for e in endpoints for t in (f"{topic}/{e}", f"{topic}/{e}/get"))
+
+class DeviceRegistry:
+    """Topic -> precompiled route, built from bridge/devices.
+
+    Lookups are lock-free dict reads; updates swap in a new dict. The MQTT topics
+    of forwarded devices are kept per bridge too, for narrowed subscriptions.
+    """
+    def __init__(self):
+        self.routes: Dict[str, Route] = {}
+        self.by_bridge: Dict[str, Dict[str, Route]] = {}
+        self.topics: Dict[str, Dict[str, Tuple[str, ...]]] = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, callback):
+        # callback(base, added, removed) with the MQTT topics of forwarded devices, after each update
+        self.listeners.append(callback)
+
+    def update(self, bridge_topic: str, changed: Dict[str, dict], removed: list):
+        base = bridge_topic[:-len('/bridge/devices')] if bridge_topic.endswith('/bridge/devices') else bridge_topic
+        with self.lock:
+            bridge = dict(self.by_bridge.get(base, {}))
+            topics = self.topics.setdefault(base, {})
+            before = {t for name in list(removed) + list(changed) for t in topics.get(f"{base}/{name}", ())}
+            for name in removed:
+                bridge.pop(f"{base}/{name}", None)
+                topics.pop(f"{base}/{name}", None)
+            for name, device in changed.items():
+                route = bridge[f"{base}/{name}"] = compile_route(device)
+                topics[f"{base}/{name}"] = device_topics(f"{base}/{name}", device, route)
+            after = {t for name in changed for t in topics[f"{base}/{name}"]}
+            self.by_bridge[base] = bridge
+            routes = {}
+            for entries in self.by_bridge.values(): routes.update(entries)
+            self.routes = routes
+        if before != after:
+            for callback in self.listeners:
+                callback(base, sorted(after - before), sorted(before - after))
+
+    def subscriptions(self, base: str) -> List[str]:
+        # every topic to subscribe to for a bridge (reconnects start from scratch)
+        with self.lock:
+            return [t for topics in self.topics.get(base, {}).values() for t in topics]
+
+    def lookup(self, topic: str) -> Optional[Route]:
+        route = self.routes.get(topic)
+        if route is None:
+            # endpoint sub-topic: base/x/room/device/l1
+            parts = split_topic(topic)
+            if parts[-1] in ('l1', 'l2'):
+                route = self.routes.get(topic[:-3])
+        return route
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+device_registry = DeviceRegistry()
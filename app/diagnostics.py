@@ -0,0 +1,197 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import DIAG_SECONDS, DIAG_PROFILER, DIAG_SAMPLE_MS, DIAG_DIR, DIAG_TOP, logger
+
+STAGES = ('decode', 'process', 'cache', 'route', 'submit', 'deliver')
+MAX_TRACED = 100000  # values kept per stage and window
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))] if values else 0.0
+
+class Diagnostics:
+    """On-demand profiling and per-message stage tracing for a time window.
+
+    Started by SIGUSR1 or a client/diag message; off, call sites only check
+    `active` / `tracing`. When the window ends the profile (cProfile .prof or
+    sampled .folded stacks) and a top-N summary (.txt, also logged) are written
+    to DIAG_DIR. With WORKER_PROCESSES the process/cache stages run in the
+    workers and are not traced.
+    """
+    def __init__(self):
+        self.active = False
+        self.tracing = False
+        self.lock = threading.Lock()
+        self.deadline = 0.0
+        self.profiler = ''
+        self.top = DIAG_TOP
+        self.label = ''
+        self.profile: Optional[cProfile.Profile] = None
+        self.owner: Optional[int] = None
+        self.sampler: Optional[threading.Thread] = None
+        self.timer: Optional[threading.Timer] = None
+        self.report: Optional[threading.Thread] = None
+        self.samples: Counter = Counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.messages: List[Tuple[float, str, Tuple[float, ...]]] = []
+
+    def start(self, seconds: float = DIAG_SECONDS, profiler: str = DIAG_PROFILER, trace: bool = True,
+              top: int = DIAG_TOP) -> bool:
+        # may run in a signal handler: never wait for the lock
+        if not self.lock.acquire(timeout=1): return False
+        try:
+            if self.active:
+                logger.warning("Diagnostics already running")
+                return False
+            if self.report is not None and self.report.is_alive():
+                logger.warning("Diagnostics report of the last window is still being written")
+                return False
+            self.profiler = profiler if profiler in ('sample', 'cprofile') else ''
+            self.top, self.tracing = top, trace
+            self.samples, self.stages, self.messages = Counter(), {}, []
+            self.label = datetime.now().strftime('%Y%m%d-%H%M%S')
+            self.deadline = time.monotonic() + seconds
+            if self.profiler == 'cprofile':
+                # deterministic, but only on this thread: the MQTT network thread / the event loop
+                self.profile, self.owner = cProfile.Profile(), threading.get_ident()
+                self.profile.enable()
+            elif self.profiler == 'sample':
+                self.sampler = threading.Thread(target=self._sample_loop, name='diag-sampler', daemon=True)
+            self.timer = threading.Timer(seconds + 0.05, self.poll)
+            self.timer.daemon = True
+            self.active = True
+        finally: self.lock.release()
+        if self.sampler: self.sampler.start()
+        self.timer.start()
+        logger.info(f"Diagnostics on for {seconds:g}s (profiler: {self.profiler or 'off'}, trace: {trace})")
+        return True
+
+    def stop(self):
+        # end the window now (on this thread, so a cProfile started here is stopped too)
+        self.deadline = 0.0
+        self.poll()
+
+    def toggle(self):
+        # SIGUSR1 handler: start() and finish() never wait for the lock, finish() writes on a thread of its own
+        if self.active: self.stop()
+        else: self.start()
+
+    def control(self, text: str):
+        # client/diag: '' = defaults, or JSON {"seconds", "profiler": sample|cprofile|off, "trace", "top"}; seconds 0 = stop
+        try: spec = json.loads(text) if text.strip() else {}
+        except ValueError:
+            logger.error(f"Invalid client/diag message: {text!r}")
+            return
+        if not isinstance(spec, dict): spec = {}
+        if float(spec.get('seconds', DIAG_SECONDS)) <= 0: return self.stop()
+        self.start(float(spec.get('seconds', DIAG_SECONDS)), str(spec.get('profiler', DIAG_PROFILER)).lower(),
+                   bool(spec.get('trace', True)), int(spec.get('top', DIAG_TOP)))
+
+    def poll(self):
+        # window over? cProfile can only be disabled on its own thread: it waits for that thread's next message
+        if not self.active or time.monotonic() < self.deadline: return
+        if self.profile is not None and threading.get_ident() != self.owner: return
+        self.finish()
+
+    def finish(self):
+        # never wait for the lock: whoever holds it is starting or finishing a window already
+        if not self.lock.acquire(blocking=False): return
+        try:
+            if not self.active: return
+            self.active = self.tracing = False
+            profile, self.profile = self.profile, None
+            sampler, self.sampler = self.sampler, None
+            if self.timer: self.timer.cancel()
+            if profile is not None: profile.disable()
+            # joining the sampler and writing the files stay off the calling thread (MQTT / event loop)
+            self.report = threading.Thread(target=self._report, args=(profile, sampler), name='diag-report', daemon=True)
+            self.report.start()
+        finally: self.lock.release()
+
+    def _report(self, profile: Optional[cProfile.Profile], sampler: Optional[threading.Thread]):
+        if sampler is not None: sampler.join()
+        try: self._write(profile)
+        except Exception as e: logger.error(f"Diagnostics write error: {e}")
+
+    def stage(self, name: str, seconds: float):
+        values = self.stages.setdefault(name, [])
+        if len(values) < MAX_TRACED: values.append(seconds)
+
+    def message(self, topic: str, started: float, decoded: float, routed: float, submitted: float):
+        # one routed MQTT message: on_message -> decode -> route_message -> deliver()
+        self.stage('decode', decoded - started)
+        self.stage('route', routed - decoded)
+        self.stage('submit', submitted - routed)
+        if len(self.messages) < MAX_TRACED:
+            self.messages.append((submitted - started, topic, (decoded - started, routed - decoded, submitted - routed)))
+
+    def _sample_loop(self):
+        interval = max(0.001, DIAG_SAMPLE_MS / 1000.0)
+        me = threading.get_ident()
+        while self.active:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me: continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+
+    def _write(self, profile: Optional[cProfile.Profile]):
+        base = os.path.join(DIAG_DIR, f"z2m-diag-{self.label}")
+        lines = [f"Diagnostics {self.label} (profiler: {self.profiler or 'off'})"]
+        if profile is not None:
+            profile.dump_stats(f"{base}.prof")
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+            lines += [f"profile: {base}.prof", out.getvalue()]
+        elif self.samples:
+            # collapsed stacks, flamegraph.pl / speedscope input
+            with open(f"{base}.folded", 'w') as f:
+                for stack, count in self.samples.most_common(): f.write(f"{stack} {count}\n")
+            lines += [f"samples: {base}.folded"] + self._sample_summary()
+        if self.stages: lines += self._trace_summary()
+        summary = '\n'.join(lines)
+        with open(f"{base}.txt", 'w') as f: f.write(summary + '\n')
+        logger.info(summary)
+
+    def _sample_summary(self) -> List[str]:
+        total = sum(self.samples.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames[1:]): inclusive[frame] += count
+        lines = [f"{total} samples over all threads (idle waits included); top {self.top} own:"]
+        lines += [f"{100.0 * c / total:6.1f}%  {f}" for f, c in own.most_common(self.top)]
+        lines += [f"top {self.top} inclusive:"]
+        lines += [f"{100.0 * c / total:6.1f}%  {f}" for f, c in inclusive.most_common(self.top)]
+        return lines
+
+    def _trace_summary(self) -> List[str]:
+        lines = [f"{'stage':<8} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name in STAGES:
+            values = self.stages.get(name)
+            if not values: continue
+            lines.append(f"{name:<8} {len(values):>8} {_percentile(values, 50) * 1000:>9.3f} "
+                         f"{_percentile(values, 99) * 1000:>9.3f} {max(values) * 1000:>9.3f}")
+        if self.messages:
+            lines.append(f"slowest {self.top} messages (decode / route / submit ms):")
+            for total, topic, parts in sorted(self.messages, reverse=True)[:self.top]:
+                lines.append(f"{total * 1000:9.3f}  {topic}  " + ' / '.join(f"{p * 1000:.3f}" for p in parts))
+        return lines
+
+diagnostics = Diagnostics()
@@ -0,0 +1,116 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set
+
+MISSING = object()
+
+class CacheEntry:
+    __slots__ = ('value', 'stamp', 'deadline', 'tick')
+
+    def __init__(self, value: Any, stamp: float, deadline: float, tick: int):
+        self.value = value
+        self.stamp = stamp
+        self.deadline = deadline
+        self.tick = tick
+
+class ExpiringCache:
+    """Bounded LRU mapping with per-entry expiry on a timer wheel.
+
+    Entries are bucketed by expiry tick; expire() pops only the buckets that
+    came due, so removing an entry is O(1) and nothing scans the whole cache.
+    The clock is monotonic, so wall-clock jumps do not expire or revive entries.
+    """
+    def __init__(self, ttl: float, max_entries: int = 0, resolution: float = 1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.clock = clock
+        self.entries: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self.wheel: Dict[int, Set[Hashable]] = {}
+        self.cursor = int(clock() // resolution)
+        self.evicted = 0
+        self.expired = 0
+        self.lock = threading.Lock()
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        now = self.clock()
+        deadline = now + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self._expire(now)
+            tick = max(math.ceil(deadline / self.resolution), self.cursor)
+            old = self.entries.pop(key, None)
+            if old is not None: self._unschedule(key, old)
+            self.entries[key] = CacheEntry(value, now, deadline, tick)
+            self.wheel.setdefault(tick, set()).add(key)
+            while self.max_entries and len(self.entries) > self.max_entries:
+                lru_key, lru = self.entries.popitem(last=False)
+                self._unschedule(lru_key, lru)
+                self.evicted += 1
+
+    def entry(self, key: Hashable) -> Optional[CacheEntry]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None: return None
+            if entry.deadline <= self.clock():
+                del self.entries[key]
+                self._unschedule(key, entry)
+                self.expired += 1
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entry(key)
+        return default if entry is None else entry.value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None: return default
+            self._unschedule(key, entry)
+            return entry.value
+
+    def expire(self) -> int:
+        with self.lock:
+            return self._expire(self.clock())
+
+    def _expire(self, now: float) -> int:
+        now_tick = int(now // self.resolution)
+        if now_tick < self.cursor: return 0
+        if now_tick - self.cursor > len(self.wheel):
+            # long idle: visit only the buckets that exist
+            ticks = sorted(t for t in self.wheel if t <= now_tick)
+        else:
+            ticks = range(self.cursor, now_tick + 1)
+        removed = 0
+        for tick in ticks:
+            for key in self.wheel.pop(tick, ()):
+                entry = self.entries.get(key)
+                if entry is not None and entry.tick == tick:
+                    del self.entries[key]
+                    removed += 1
+        self.cursor = now_tick + 1
+        self.expired += removed
+        return removed
+
+    def _unschedule(self, key: Hashable, entry: CacheEntry):
+        bucket = self.wheel.get(entry.tick)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket: del self.wheel[entry.tick]
+
+    def items(self):
+        with self.lock:
+            return [(k, e.value) for k, e in self.entries.items()]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.entry(key) is not None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> dict:
+        return {'size': len(self.entries), 'max_entries': self.max_entries,
+                'evicted': self.evicted, 'expired': self.expired}
@@ -0,0 +1,92 @@
+import json
+import os
+from typing import Any, Dict, Optional
+from config import FILTER_POLICY_FILE, FILTER_MIN_INTERVAL, FILTER_MAX_SILENCE, logger
+
+# Built-in rules. A policy file ({"default": {...}, "rooms": {room: {...}}, "devices": {name: {...}}})
+# overrides them per property; "*" applies to properties without a rule of their own.
+DEFAULT_RULES = {
+    'avnewstatus': {'mode': 'exact'},
+    'brightness': {'mode': 'exact'},
+    'contact': {'mode': 'exact'},
+    'occupancy': {'mode': 'exact'},
+    'battery': {'mode': 'exact'},
+    'temperature': {'abs': 0.5, 'hysteresis': 0.2},
+    'humidity': {'abs': 2, 'hysteresis': 0.5},
+    'pressure': {'abs': 1},
+    'illuminance': {'abs': 5, 'rel': 0.1},
+    'power': {'abs': 2, 'rel': 0.1},
+    'energy': {'abs': 0.05},
+    'voltage': {'rel': 0.02},
+    'current': {'abs': 0.05, 'rel': 0.1},
+}
+
+class Rule:
+    __slots__ = ('exact', 'abs', 'rel', 'hysteresis', 'min_interval', 'max_silence')
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.abs = float(spec.get('abs', 0))
+        self.rel = float(spec.get('rel', 0))
+        self.exact = spec.get('mode') == 'exact' or not (self.abs or self.rel)
+        self.hysteresis = float(spec.get('hysteresis', 0))
+        self.min_interval = float(spec.get('min_interval', FILTER_MIN_INTERVAL))
+        self.max_silence = float(spec.get('max_silence', FILTER_MAX_SILENCE))
+
+    def changed(self, old: Any, new: Any, direction: int = 0) -> bool:
+        """True if old -> new is a meaningful change. direction is the sign of the last sent change."""
+        if self.exact or old is None or new is None:
+            return old != new
+        try:
+            old_f, new_f = float(old), float(new)
+        except (TypeError, ValueError):
+            return old != new
+        delta = new_f - old_f
+        band = max(self.abs, self.rel * abs(old_f))
+        if direction and delta * direction < 0:
+            # turning back: must clear the band plus the hysteresis
+            band += self.hysteresis
+        return abs(delta) >= band if band else delta != 0
+
+class PropertyRules:
+    __slots__ = ('rules', 'fallback', 'max_silence')
+
+    def __init__(self, specs: Dict[str, Dict[str, Any]]):
+        self.rules = {k: Rule(v) for k, v in specs.items() if k != '*' and v is not None}
+        self.fallback = Rule(specs['*']) if specs.get('*') else None
+        silences = [r.max_silence for r in self.rules.values()]
+        self.max_silence = min(silences) if silences else FILTER_MAX_SILENCE
+
+    def get(self, key: str) -> Optional[Rule]:
+        return self.rules.get(key, self.fallback)
+
+class FilterPolicy:
+    def __init__(self, path: str = FILTER_POLICY_FILE):
+        self.config = self._load(path)
+        self.resolved: Dict[tuple, PropertyRules] = {}
+
+    def _load(self, path: str) -> dict:
+        if not path or not os.path.exists(path): return {}
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+            logger.info(f"Filter policy loaded: {path}")
+            return config
+        except Exception as e:
+            logger.error(f"Error loading filter policy {path}: {e}")
+            return {}
+
+    def rules_for(self, device_name: str, room: Optional[str]) -> PropertyRules:
+        key = (device_name, room)
+        rules = self.resolved.get(key)
+        if rules is None:
+            # built-in <- default <- room <- device
+            specs = dict(DEFAULT_RULES)
+            for layer in (self.config.get('default', {}), self.config.get('rooms', {}).get(room or '', {}),
+                          self.config.get('devices', {}).get(device_name, {})):
+                for prop, spec in layer.items():
+                    # null disables a property, a dict refines the rule below it
+                    specs[prop] = None if spec is None else {**(specs.get(prop) or {}), **spec}
+            rules = self.resolved[key] = PropertyRules(specs)
+        return rules
+
+filter_policy = FilterPolicy()
@@ -1,30 +1,186 @@
+import threading
+import time
 import requests
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from client_channel import ClientChannel
 from client_manager import client_manager
-from config import logger
+from codec import Payload, accepts_gzip, dumps
+from priority import priority_rules
+from subscriptions import subscription_index
+from metrics import ENABLED as METRICS_ENABLED, delivery_errors, delivery_seconds, registry
+from config import (HTTP_MAX_WORKERS, HTTP_CONNECT_TIMEOUT, HTTP_DEVICE_TIMEOUT, HTTP_DATA_TIMEOUT, HTTP_DATA_PORT,
+                    HTTP_CLIENT_TIMEOUTS, HTTP_BATCH_MODE, HTTP_BATCH_MAX, DEVICE_LIST_DELTA, LOG_DEBUG, logger)
+from device_list_processor import last_device_lists
+from diagnostics import diagnostics
+
+DEVICE_LIST_KEY = '__device_list__'
+
+def list_key(data: Any) -> str:
+    # one pending list per bridge, so bridges do not replace each other's push
+    bridge = data.get('bridge', '') if isinstance(data, dict) else ''
+    return f"{DEVICE_LIST_KEY}/{bridge}"
+
+def client_timeout(ip: str, read_timeout: float) -> tuple:
+    # (connect, read); HTTP_CLIENT_TIMEOUTS caps both for a given client
+    override = HTTP_CLIENT_TIMEOUTS.get(ip)
+    if override:
+        return (min(HTTP_CONNECT_TIMEOUT, float(override)), float(override))
+    return (HTTP_CONNECT_TIMEOUT, read_timeout)
+
+JSON_HEADERS = {'Content-Type': 'application/json; charset=utf-8'}
+GZIP_HEADERS = {**JSON_HEADERS, 'Content-Encoding': 'gzip'}
+
+def batch_body(items: List[dict]) -> dict:
+    return {'timestamp': datetime.now().isoformat(), 'count': len(items), 'updates': items}
+
+def list_request(payload: Payload, gzip_ok: bool) -> tuple:
+    # (body, headers) for a device list; the encoded bytes are shared by every client
+    if gzip_ok and payload.compressible(): return payload.gzipped(), GZIP_HEADERS
+    return payload.body(), JSON_HEADERS
 
 class HTTPClient:
-    def send_z2mqtt_data(self, data: Any, port: int):
-        ips = client_manager.get_all_ips()
-        for ip in ips:
-            try:
-                url = f"http://{ip}:{port}"
-                headers = {'Content-Type': 'application/json; charset=utf-8'}
-                #  GET method with JSON body
-                requests.get(url, json=data, headers=headers, timeout=15)
-                logger.debug(f"Device list elküldve -> {ip}")
-            except Exception as e:
-                logger.error(f"HTTP küldési hiba (lista) -> {ip}: {e}")
+    def __init__(self, max_workers: int = HTTP_MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http')
+        self.sessions = {}
+        self.channels: Dict[str, ClientChannel] = {}
+        self.timers: Dict[str, threading.Timer] = {}
+        self.lock = threading.Lock()
+        client_manager.add_listener(self.on_client_registered)
+        client_manager.add_retire_listener(self.on_client_retired)
+
+    def _session(self, ip: str) -> requests.Session:
+        # one keep-alive session per client
+        with self.lock:
+            session = self.sessions.get(ip)
+            if session is None:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0))
+                self.sessions[ip] = session
+            return session
+
+    def channel(self, ip: str) -> ClientChannel:
+        with self.lock:
+            channel = self.channels.get(ip)
+            if channel is None:
+                channel = self.channels[ip] = ClientChannel(ip)
+            return channel
+
+    def on_client_registered(self, name: str, ip: str, old_ip: Optional[str]):
+        channel = self.channel(ip)
+        channel.reset()
+        self._kick(channel)
 
-    def send_device_data(self, data: Any, port: int):
-        ips = client_manager.get_all_ips()
-        for ip in ips:
+    def on_client_retired(self, old_ip: str, new_ip: Optional[str]):
+        # stop probing the old IP; what was waiting for it follows the client to its new one
+        with self.lock:
+            channel = self.channels.pop(old_ip, None)
+            timer = self.timers.pop(old_ip, None)
+            session = self.sessions.pop(old_ip, None)
+        if timer: timer.cancel()
+        if session: session.close()
+        if channel is None: return
+        channel.retired = True
+        entries = channel.take_all()
+        if new_ip and entries:
+            target = self.channel(new_ip)
+            for key, entry in entries: target.offer(key, entry)
+            self._kick(target)
+
+    def _kick(self, channel: ClientChannel):
+        if channel.retired: return
+        now = time.monotonic()
+        if channel.acquire(now):
+            self.executor.submit(self._drain, channel)
+        elif channel.pending and not channel.busy:
+            self._schedule(channel, channel.retry_delay(now))
+
+    def _schedule(self, channel: ClientChannel, delay: float):
+        with self.lock:
+            if channel.retired or channel.ip in self.timers: return
+            timer = threading.Timer(delay, self._on_timer, args=(channel,))
+            timer.daemon = True
+            self.timers[channel.ip] = timer
+        timer.start()
+
+    def _on_timer(self, channel: ClientChannel):
+        with self.lock: self.timers.pop(channel.ip, None)
+        self._kick(channel)
+
+    def _drain(self, channel: ClientChannel):
+        batch_max = HTTP_BATCH_MAX if HTTP_BATCH_MODE == 'json' else 1
+        while True:
+            taken = channel.pop(batch_max)
+            # nothing left, or only rate-limited lanes: _kick sets the token timer
+            if not taken: return self._kick(channel)
+            port, data, is_list = taken[0][1]
+            started = time.perf_counter()
             try:
-                url = f"http://{ip}:{port}"
-                # GET with query parameter
-                requests.get(url, params=data, timeout=10)
-                logger.debug(f"Eszköz adat elküldve -> {ip}")
+                if is_list: self._send_list(channel, port, data)
+                else: self._send_devices(channel, port, [entry[1] for _, entry in taken])
+                if channel.success() and DEVICE_LIST_DELTA:
+                    # back from an open circuit (its queue may have overflowed meanwhile): the full lists again
+                    for full in last_device_lists(): self.send_z2mqtt_data(full, HTTP_DATA_PORT, [channel.ip])
+                if METRICS_ENABLED:
+                    delivery_seconds.observe(time.perf_counter() - started, client=channel.ip, kind='list' if is_list else 'device')
+                if diagnostics.tracing: diagnostics.stage('deliver', time.perf_counter() - started)
             except Exception as e:
-                logger.error(f"HTTP küldési hiba (státusz) -> {ip}: {e}")
+                if METRICS_ENABLED: delivery_errors.inc(client=channel.ip)
+                delay = channel.failure(taken, time.monotonic())
+                logger.error(f"HTTP küldési hiba ({'lista' if is_list else 'státusz'}) -> {channel.ip}: {e} (retry in {delay:.1f}s)")
+                self._schedule(channel, delay)
+                return
+
+    def _send_list(self, channel: ClientChannel, port: int, payload: Payload):
+        ip = channel.ip
+        body, headers = list_request(payload, channel.gzip)
+        #  GET method with JSON body
+        response = self._session(ip).get(f"http://{ip}:{port}", data=body, headers=headers,
+                                         timeout=client_timeout(ip, HTTP_DATA_TIMEOUT))
+        channel.gzip = accepts_gzip(response.headers)
+        if LOG_DEBUG: logger.debug(f"Device list elküldve -> {ip}")
+
+    def _send_devices(self, channel: ClientChannel, port: int, payloads: List[Payload]):
+        ip = channel.ip
+        url = f"http://{ip}:{port}"
+        timeout = client_timeout(ip, HTTP_DEVICE_TIMEOUT)
+        if len(payloads) == 1:
+            # GET with query parameter
+            self._session(ip).get(f"{url}?{payloads[0].query()}", timeout=timeout)
+        else:
+            # Batch: GET with JSON body, same transport as the device list
+            body = dumps(batch_body([p.data for p in payloads]))
+            self._session(ip).get(url, data=body, headers=JSON_HEADERS, timeout=timeout)
+        if LOG_DEBUG: logger.debug(f"Eszköz adat elküldve ({len(payloads)}) -> {ip}")
+
+    def _enqueue(self, entries: List[tuple], ips: Optional[List[str]] = None):
+        # offer everything before kicking, so one drain can pick up the whole batch
+        for ip, mine in subscription_index.fan_out(entries, ips):
+            channel = self.channel(ip)
+            for key, entry in mine:
+                channel.offer(key, entry)
+            self._kick(channel)
+
+    def send_z2mqtt_data(self, data: Any, port: int, ips: Optional[List[str]] = None):
+        self._enqueue([(list_key(data), (port, Payload(data, priority_rules.device_list), True))], ips)
+
+    def send_device_data(self, data: Any, port: int, ips: Optional[List[str]] = None, answer: bool = False):
+        # one pending entry per device; batching happens per client on drain (answer: /get answers, always batched)
+        items = data if isinstance(data, list) else [data]
+        self._enqueue([(str(i.get('avdevicename', '')), (port, Payload(i, priority_rules.of(i), answer), False))
+                       for i in items if isinstance(i, dict)], ips)
+
+    def stats(self) -> Dict[str, dict]:
+        with self.lock: channels = list(self.channels.values())
+        return {c.ip: c.stats() for c in channels}
+
+def register_channel_gauges(stats):
+    # stats() -> {ip: ClientChannel.stats()}, from whichever delivery engine runs
+    registry.gauge('z2m_client_pending', 'Updates waiting in a client queue',
+                   lambda: [({'client': ip}, s['pending']) for ip, s in stats().items()])
+    registry.gauge('z2m_client_circuit_open', 'Client circuit breaker open (1) or closed (0)',
+                   lambda: [({'client': ip}, int(s['state'] != 'closed')) for ip, s in stats().items()])
 
-http_client = HTTPClient()
\ No newline at end of file
+http_client = HTTPClient()
@@ -2,19 +2,68 @@ import signal
 import sys
 import threading
 import time
-from config import logger
-from mqtt_handler import MQTTHandler
+from cache_manager import device_cache
+from client_manager import client_manager
+from config import RUNTIME, logger
+from diagnostics import diagnostics
+from http_client import http_client
+from metrics import start_server as start_metrics_server
+from message_router import release_held
+from mqtt_handler import MQTTHandler, brokers
+from pipeline import delivery_pipeline
+from recorder import traffic_recorder
+from sharding import shard_router
 from services import device_status_manager, get_response_cache
+from snapshot import state_snapshot
 
 def cleanup_loop():
+    # caches expire on their own timer wheels; this only advances idle ones and reports
     while True:
         time.sleep(300)
+        device_cache.cleanup()
         device_status_manager.cleanup()
         get_response_cache.cleanup()
+        logger.info(f"Caches: device {device_cache.cache.stats()}, get {get_response_cache.cache.stats()}")
+        logger.info(f"Delivery queue: {delivery_pipeline.queue.stats()}")
+        logger.info(f"Client channels: {http_client.stats()}")
+
+def release_loop(handler: MQTTHandler):
+    # rate-limited changes go out once their min_interval is over, even if the device stays quiet
+    while True:
+        time.sleep(1)
+        try:
+            data = release_held()
+            if data: handler.deliver(data, False, False)
+        except Exception as e: logger.error(f"Release error: {e}")
+
+def shutdown(signum, frame):
+    state_snapshot.save()
+    client_manager.flush()
+    traffic_recorder.close()
+    shard_router.stop()
+    sys.exit(0)
 
 if __name__ == "__main__":
-    signal.signal(signal.SIGINT, lambda s, f: sys.exit(0))
-    signal.signal(signal.SIGTERM, lambda s, f: sys.exit(0))
-    threading.Thread(target=cleanup_loop, daemon=True).start()
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    # profile + trace window on demand (kill -USR1), a second one ends it early
+    signal.signal(signal.SIGUSR1, lambda signum, frame: diagnostics.toggle())
+    state_snapshot.load()
+    client_manager.start_watcher()
+    start_metrics_server()
     logger.info("Z2MQTT2HTTP Starting...")
-    MQTTHandler().start()
\ No newline at end of file
+    if RUNTIME == 'asyncio':
+        # aiohttp is only needed in this mode
+        if shard_router.enabled: logger.warning("WORKER_PROCESSES is ignored with RUNTIME=asyncio")
+        from async_runtime import run
+        run()
+    else:
+        state_snapshot.start()
+        threading.Thread(target=cleanup_loop, daemon=True).start()
+        shards = shard_router if shard_router.enabled else None
+        handlers = [MQTTHandler(shards=shards, broker=broker) for broker in brokers()]
+        # with shards the device cache lives in the workers, which release on their own
+        if shards is None: threading.Thread(target=release_loop, args=(handlers[0],), name='release', daemon=True).start()
+        # further brokers run on paho threads, the first one on the main thread
+        for handler in handlers[1:]: handler.start(block=False)
+        handlers[0].start()
\ No newline at end of file
@@ -1,24 +1,45 @@
+import time
 from typing import Dict, Any, Optional, Union, List
-from config import MQTT_TOPIC, logger
+from codec import GetAnswers
+from config import logger
+from diagnostics import diagnostics
 from cache_manager import device_cache
 from services import device_status_manager, get_response_cache
 from device_processors import process_light_dimmer, process_power_switch, process_sensor_data
 from device_list_processor import process_device_list
+from device_registry import device_registry
+from topics import is_device_list, namespace, split_topic
+from metrics import ENABLED as METRICS_ENABLED, cache_checks
 
 def route_message(topic: str, payload: Any) -> tuple[Optional[Union[Dict, List]], bool]:
     try:
         # 1. Device List
-        if topic.endswith('bridge/devices') or topic == "usb/bridge/devices":
+        if is_device_list(topic):
             return process_device_list(payload, topic), True
 
-        # 2. GET Request
+        # 2. GET Request: answered from the known state if fresh, else by the device's reply (is_manual below)
         if topic.endswith('/get'):
-            device_status_manager.add(topic)
+            answers = [item for item in device_status_manager.request(topic) if _answer(item)]
+            if METRICS_ENABLED: cache_checks.inc(cache='status', result='hit' if answers else 'miss')
+            if not answers: return None, False
+            # a burst of gets reaches each client as one batch (GET_ANSWER_WINDOW_MS)
+            return GetAnswers(answers), False
+
+        if not isinstance(payload, dict) or split_topic(topic)[-1] == 'set':
             return None, False
 
         # 3. Adatfeldolgozás meghatározása
+        tracing = diagnostics.tracing
+        if tracing: started = time.perf_counter()
         result = None
-        if isinstance(payload, dict):
+        route = device_registry.lookup(topic)
+        if route is not None:
+            # Ismert eszköz (bridge/devices): előre fordított handler + releváns kulcsok
+            handler, keys = route
+            if handler and any(k in payload for k in keys):
+                result = handler(topic, payload)
+        else:
+            # Ismeretlen eszköz: payload alapján találgatunk
             # Van fényerő adat? -> Dimmer
             if any(k in payload for k in ['brightness', 'brightness_l1', 'brightness_l2']):
                 result = process_light_dimmer(topic, payload)
@@ -31,13 +52,21 @@ def route_message(topic: str, payload: Any) -> tuple[Optional[Union[Dict, List]]
             elif any(k in payload for k in ['humidity', 'temperature', 'contact', 'occupancy']):
                 result = process_sensor_data(topic, payload)
 
+        if tracing:
+            processed = time.perf_counter()
+            diagnostics.stage('process', processed - started)
         if not result:
             return None, False
         
         # Iterálható formátum (Dual eszközök tÖbB  elemet adhatnak vissza)
         results = result if isinstance(result, list) else [result]
+        ns = namespace(topic)
+        if ns:
+            # same device name on another bridge: ns:name everywhere from here on (caches, queues, clients)
+            for item in results:
+                if item.get('avdevicename'): item['avdevicename'] = f"{ns}:{item['avdevicename']}"
         final_list = []
-        is_manual = device_status_manager.is_pending(topic)
+        is_manual = device_status_manager.take(topic)
 
         for item in results:
             dev_name = str(item.get('avdevicename', ''))
@@ -46,22 +75,39 @@ def route_message(topic: str, payload: Any) -> tuple[Optional[Union[Dict, List]]
 
             if is_manual:
                 # Manuális GET kérés: Cache bypass, GetCache duplikáció szűrés
-                status_val = str(item.get('avnewstatus', ''))
-                if get_response_cache.should_send(dev_name, status_val):
-                    get_response_cache.update(dev_name, status_val)
+                if _answer(item):
+                    # the device cache has it too, a later report is filtered against it
+                    device_cache.update(dev_name, item)
                     final_list.append(item)
-                device_status_manager.fulfill(topic)
             else:
                 # Automatikus jelentés: SZŰRÉS A fő cache alapján
-                if not device_cache.should_filter_message(dev_name, item):
+                filtered = device_cache.should_filter_message(dev_name, item)
+                if METRICS_ENABLED: cache_checks.inc(cache='device', result='hit' if filtered else 'miss')
+                if not filtered:
                     device_cache.update(dev_name, item)
                     final_list.append(item)
+        if tracing: diagnostics.stage('cache', time.perf_counter() - processed)
         
         if not final_list:
             return None, False
+        if is_manual: return GetAnswers(final_list), False
             
         return (final_list[0] if len(final_list) == 1 else final_list), False
 
     except Exception as e:
         logger.error(f"Router hiba topic-nál ({topic}): {e}")
-        return None, False
\ No newline at end of file
+        return None, False
+
+def release_held() -> Optional[Union[Dict, List]]:
+    # changes held back by a min_interval that are due now, in route_message's form (None = nothing)
+    items = device_cache.release_held()
+    if not items: return None
+    return items[0] if len(items) == 1 else items
+
+def _answer(item: dict) -> bool:
+    # a manual get answer goes out unless the same one just did (GetResponseCache)
+    dev_name = str(item.get('avdevicename', ''))
+    send = get_response_cache.should_send(dev_name, item)
+    if METRICS_ENABLED: cache_checks.inc(cache='get', result='miss' if send else 'hit')
+    if send: get_response_cache.update(dev_name, item)
+    return send
\ No newline at end of file
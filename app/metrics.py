@@ -0,0 +1,136 @@
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Iterable, List, Tuple
+from config import METRICS_PORT, logger
+
+# Call sites check ENABLED before touching the clock or a metric, so a disabled
+# endpoint costs one global lookup per instrumented spot.
+ENABLED = METRICS_PORT > 0
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _fmt_labels(labels: Labels, extra: str = '') -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra: parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help = name, help_text
+        self.values: Dict[Labels, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            lines += [f"{self.name}{_fmt_labels(k)} {v}" for k, v in self.values.items()]
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help = name, help_text
+        self.buckets = buckets
+        self.series: Dict[Labels, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in self.series.items():
+                total = 0
+                for bound, count in zip(self.buckets, series):
+                    total += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, le)} {total}")
+                total += series[len(self.buckets)]
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, le)} {total}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {total}")
+        return lines
+
+class Gauge:
+    # sampled at scrape time: fn() -> iterable of (labels dict, value)
+    def __init__(self, name: str, help_text: str, fn: Callable[[], Iterable[Tuple[dict, float]]]):
+        self.name, self.help, self.fn = name, help_text, fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            lines += [f"{self.name}{_fmt_labels(tuple(sorted(l.items())))} {v}" for l, v in self.fn()]
+        except Exception as e:
+            logger.error(f"Metrics gauge {self.name} error: {e}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], Iterable[Tuple[dict, float]]]):
+        if ENABLED: self.metrics.append(Gauge(name, help_text, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics: lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# Stage latencies: decode, route, deliver (per client)
+stage_seconds = registry.histogram('z2m_stage_seconds', 'Time spent per processing stage')
+delivery_seconds = registry.histogram('z2m_delivery_seconds', 'HTTP delivery latency per client')
+delivery_errors = registry.counter('z2m_delivery_errors_total', 'Failed HTTP deliveries per client')
+messages_total = registry.counter('z2m_messages_total', 'MQTT messages received')
+cache_checks = registry.counter('z2m_cache_checks_total', 'Cache filter decisions')
+
+def start_server(port: int = METRICS_PORT):
+    if not ENABLED: return
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Metrics endpoint on :{port}/metrics")
@@ -1,41 +1,173 @@
-import json
+import time
+from typing import List, NamedTuple, Optional
 import paho.mqtt.client as mqtt
-from config import MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TOPIC, HTTP_DATA_PORT, HTTP_DEVICE_PORT, logger
+from config import (MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TOPIC, MQTT_BROKERS, MQTT_SUBSCRIBE,
+                    DEVICE_LIST_DELTA, WARMUP_SECONDS, logger)
 from client_manager import client_manager
-from http_client import http_client
+from codec import loads
+from device_list_processor import last_device_lists
+from device_registry import device_registry
+from diagnostics import diagnostics
 from message_router import route_message
+from metrics import ENABLED as METRICS_ENABLED, messages_total, stage_seconds
+from pipeline import delivery_pipeline
+from recorder import traffic_recorder
+from topics import is_device_list, is_relevant
+
+SUBSCRIBE_CHUNK = 100  # topics per SUBSCRIBE / UNSUBSCRIBE packet
+
+class Broker(NamedTuple):
+    host: str
+    port: int
+    user: Optional[str]
+    password: Optional[str]
+    topic: str
+    namespace: str  # '' = topics and device names as they come
+    clients: bool   # client/con_ip and client/subscribe are taken from this broker
+
+    @property
+    def label(self) -> str:
+        return f"{self.host}:{self.port}/{self.topic}"
+
+def brokers() -> List[Broker]:
+    # MQTT_BROKERS entries, each falling back to the single-broker settings; the first one handles clients.
+    # The clients broker keeps plain device names unless set, every other one is namespaced (its index unless
+    # set): adding a bridge renames nothing that clients, filter policies or scopes already know.
+    specs = MQTT_BROKERS or [{}]
+    result = []
+    for index, spec in enumerate(specs):
+        clients = bool(spec.get('clients', index == 0))
+        result.append(Broker(spec.get('host', MQTT_BROKER), int(spec.get('port', MQTT_PORT)), spec.get('user', MQTT_USERNAME),
+                             spec.get('password', MQTT_PASSWORD), spec.get('topic', MQTT_TOPIC),
+                             str(spec.get('namespace', '' if clients else index)), clients))
+    seen = set()
+    for broker in result:
+        if (broker.namespace, broker.topic) in seen:
+            raise ValueError(f"MQTT_BROKERS: {broker.label} has the same topic and namespace as another broker")
+        seen.add((broker.namespace, broker.topic))
+    return result
 
 class MQTTHandler:
-    def __init__(self):
+    def __init__(self, sink=None, shards=None, broker: Optional[Broker] = None):
+        # sink: where routed data goes, submit(data, is_list, ips=None); the thread pipeline by default
+        # shards: ShardRouter routing state messages in worker processes, None = route here
+        self.sink = sink or delivery_pipeline
+        self.shards = shards
+        self.broker = broker or brokers()[0]
         self.client = mqtt.Client()
-        if MQTT_USERNAME and MQTT_PASSWORD:
-            self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        if self.broker.user and self.broker.password:
+            self.client.username_pw_set(self.broker.user, self.broker.password)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.warmup_until = None
+        # registry key of this broker's bridge: ns@base when namespaced (see on_message)
+        self.base = f"{self.broker.namespace}@{self.broker.topic}" if self.broker.namespace else self.broker.topic
+        if MQTT_SUBSCRIBE == 'devices':
+            device_registry.add_listener(self.on_devices_changed)
+        if self.broker.clients:
+            if DEVICE_LIST_DELTA:
+                client_manager.add_listener(self.on_client_registered)
+            # a new subscription means a different device list
+            client_manager.add_scope_listener(lambda name, ip: self.on_client_registered(name, ip, None))
+
+    def on_client_registered(self, name, ip, old_ip):
+        # delta pushes assume the client has a full list: (re)announced clients get one (every bridge's)
+        for data in last_device_lists():
+            self.sink.submit(data, True, ips=[ip])
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            logger.info("MQTT csatlakozva.")
-            client.subscribe([(f"{MQTT_TOPIC}/#", 0), ("client/con_ip", 0)])
-        else: logger.error(f"MQTT failure: {rc}")
+            logger.info(f"MQTT csatlakozva ({self.broker.label}).")
+            if self.warmup_until is None:
+                # first connect only: retained state fills the caches but is not delivered
+                self.warmup_until = time.monotonic() + WARMUP_SECONDS
+            if MQTT_SUBSCRIBE == 'devices':
+                # the device list first; device topics follow it (on_devices_changed), all of them after a reconnect
+                topics = [f"{self.broker.topic}/bridge/devices"] + [self._broker_topic(t) for t in device_registry.subscriptions(self.base)]
+            else: topics = [f"{self.broker.topic}/#"]
+            if self.broker.clients: topics += ["client/con_ip", "client/subscribe", "client/diag"]
+            self._subscribe(topics)
+        else: logger.error(f"MQTT failure ({self.broker.label}): {rc}")
+
+    def on_devices_changed(self, base: str, added: list, removed: list):
+        # forwarded devices joined, left or changed on a bridge: follow them with the subscriptions
+        if base != self.base: return
+        if removed:
+            removed = [self._broker_topic(t) for t in removed]
+            for i in range(0, len(removed), SUBSCRIBE_CHUNK): self.client.unsubscribe(removed[i:i + SUBSCRIBE_CHUNK])
+        if added: self._subscribe([self._broker_topic(t) for t in added])
+        logger.info(f"MQTT subscriptions ({self.broker.label}): +{len(added)} -{len(removed)}")
+
+    def _broker_topic(self, topic: str) -> str:
+        # registry topics carry the namespace, the broker's do not
+        return topic[len(self.broker.namespace) + 1:] if self.broker.namespace else topic
+
+    def _subscribe(self, topics: list):
+        for i in range(0, len(topics), SUBSCRIBE_CHUNK):
+            self.client.subscribe([(t, 0) for t in topics[i:i + SUBSCRIBE_CHUNK]])
 
     def on_message(self, client, userdata, msg):
         topic = msg.topic
-        try: payload_str = msg.payload.decode('utf-8')
-        except: return
-
+        if diagnostics.active: diagnostics.poll()
+        timed = METRICS_ENABLED or diagnostics.tracing
+        if timed: started = time.perf_counter()
+        if METRICS_ENABLED: messages_total.inc()
+        if self.broker.namespace and not topic.startswith('client/'):
+            # ns@base/...: registry, caches and device names of this bridge stay apart
+            topic = f"{self.broker.namespace}@{topic}"
+        if traffic_recorder.enabled: traffic_recorder.record(topic, msg.payload, msg.retain)
         if topic == "client/con_ip":
-            client_manager.update_from_mqtt(payload_str)
+            try: client_manager.update_from_mqtt(msg.payload.decode('utf-8'))
+            except UnicodeDecodeError: pass
+            return
+        if topic == "client/subscribe":
+            try: client_manager.update_scope_from_mqtt(msg.payload.decode('utf-8'))
+            except UnicodeDecodeError: pass
             return
+        if topic == "client/diag":
+            try: diagnostics.control(msg.payload.decode('utf-8'))
+            except UnicodeDecodeError: pass
+            return
+        # whatever the subscriptions still let through (wildcard mode, overlapping bridges): dropped before decoding
+        if not is_relevant(topic): return
+
+        if self.shards is not None:
+            if not is_device_list(topic):
+                self.shards.dispatch(topic, msg.payload, msg.retain)
+                return
+            # workers need every list for their routes, even one that is not pushed again
+            self.shards.broadcast(topic, msg.payload, msg.retain)
 
         try:
-            payload = json.loads(payload_str) if payload_str else {}
+            # straight from bytes; invalid UTF-8 fails here like malformed JSON
+            payload = loads(msg.payload) if msg.payload else {}
+            if timed: decoded = time.perf_counter()
             data, is_list = route_message(topic, payload)
-            if data:
-                if is_list: http_client.send_z2mqtt_data(data, HTTP_DATA_PORT)
-                else: http_client.send_device_data(data, HTTP_DEVICE_PORT)
+            if timed: routed = time.perf_counter()
+            if data: self.deliver(data, is_list, msg.retain)
+            if timed: self._timed(topic, started, decoded, routed)
         except Exception as e: logger.error(f"Handler error: {e}")
 
-    def start(self):
-        self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        self.client.loop_forever()
+    def _timed(self, topic: str, started: float, decoded: float, routed: float):
+        if METRICS_ENABLED:
+            stage_seconds.observe(decoded - started, stage='decode')
+            stage_seconds.observe(routed - decoded, stage='route')
+        if diagnostics.tracing: diagnostics.message(topic, started, decoded, routed, time.perf_counter())
+
+    def deliver(self, data, is_list: bool, retain: bool):
+        if retain and not is_list and self.warmup_until and time.monotonic() < self.warmup_until:
+            return
+        # Delivery never runs on paho's network thread / the event loop
+        self.sink.submit(data, is_list)
+
+    def start(self, block: bool = True):
+        # block: run paho's loop on this thread; otherwise in paho's own thread (further brokers)
+        delivery_pipeline.start()
+        if self.shards is not None:
+            self.shards.start(lambda data, retain: self.deliver(data, False, retain))
+        if block:
+            self.client.connect(self.broker.host, self.broker.port, 60)
+            self.client.loop_forever()
+        else:
+            self.client.connect_async(self.broker.host, self.broker.port, 60)
+            self.client.loop_start()
@@ -0,0 +1,196 @@
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+from codec import GetAnswers
+from config import (DELIVERY_QUEUE_SIZE, DELIVERY_OVERFLOW_POLICY, DELIVERY_WORKERS, DELIVERY_COALESCE_MS,
+                    GET_ANSWER_WINDOW_MS, HTTP_DATA_PORT, HTTP_DEVICE_PORT, logger)
+from device_list_processor import merge_device_lists
+from http_client import http_client, list_key, register_channel_gauges
+from metrics import registry
+from priority import HIGH, LANES, NORMAL, priority_rules
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'latest_wins')
+
+class DeliveryQueue:
+    """Bounded hand-off queue between MQTT ingest and HTTP delivery.
+
+    Items sharing a key are delivered in order and never concurrently. With
+    the latest_wins policy a queued update for the same device is replaced in
+    place, so a burst for one device costs one slot. Every priority lane has
+    its own FIFO; get serves the most urgent one first. Overflow evicts the
+    oldest item of the least urgent lane that is no more urgent than the new
+    item; if only more urgent items are queued, the new item is dropped.
+    Device lists are never dropped: a lost delta would leave the clients'
+    lists wrong until the next full push.
+    """
+    def __init__(self, maxsize: int = DELIVERY_QUEUE_SIZE, policy: str = DELIVERY_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            logger.warning(f"Unknown DELIVERY_OVERFLOW_POLICY '{policy}', using latest_wins")
+            policy = 'latest_wins'
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.lanes: List['OrderedDict[Any, Tuple[Any, Any]]'] = [OrderedDict() for _ in LANES]
+        self.inflight = set()
+        self.dropped = 0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def _key(self, data: Any, is_list: bool) -> Any:
+        if self.policy != 'latest_wins': return next(self.seq)
+        if is_list: return list_key(data)
+        items = data if isinstance(data, list) else [data]
+        return '|'.join(str(i.get('avdevicename', '')) for i in items if isinstance(i, dict)) or next(self.seq)
+
+    def put(self, data: Any, is_list: bool, lane: int = NORMAL) -> bool:
+        key = self._key(data, is_list)
+        with self.cond:
+            items = self.lanes[lane]
+            # the same device may have moved lanes: only the latest update stays (a list delta keeps the older changes)
+            existing = next((l for l in self.lanes if key in l), None)
+            if existing is not None and is_list: data = merge_device_lists(existing[key][0], data)
+            if existing is items:
+                items[key] = (data, is_list)
+                return True
+            if existing is not None: del existing[key]
+            elif self.depth >= self.maxsize and not is_list:
+                self.dropped += 1
+                victim = next(((l, k) for l in reversed(self.lanes[lane:]) for k, v in l.items() if not v[1]), None)
+                if self.policy == 'drop_newest' or victim is None:
+                    return False
+                del victim[0][victim[1]]
+            items[key] = (data, is_list)
+            self.cond.notify()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[Any, Any, bool]]:
+        # first queued item of the most urgent lane whose key is not being delivered right now
+        with self.cond:
+            while True:
+                for items in self.lanes:
+                    for key in items:
+                        if key not in self.inflight:
+                            data, is_list = items.pop(key)
+                            self.inflight.add(key)
+                            return key, data, is_list
+                if not self.cond.wait(timeout):
+                    return None
+
+    def done(self, key: Any):
+        with self.cond:
+            self.inflight.discard(key)
+            if self.depth: self.cond.notify()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(items) for items in self.lanes)
+
+    def stats(self) -> dict:
+        return {'depth': self.depth, 'lanes': [len(items) for items in self.lanes], 'inflight': len(self.inflight),
+                'dropped': self.dropped, 'maxsize': self.maxsize, 'policy': self.policy}
+
+class DeliveryPipeline:
+    def __init__(self, workers: int = DELIVERY_WORKERS, coalesce_ms: int = DELIVERY_COALESCE_MS):
+        self.queue = DeliveryQueue()
+        self.workers = max(1, workers)
+        self.threads = []
+        self.window = max(0, coalesce_ms) / 1000.0
+        self.coalesced: 'OrderedDict[str, dict]' = OrderedDict()
+        self.flush_timer = None
+        self.coalesce_lock = threading.Lock()
+        self.answer_window = max(0, GET_ANSWER_WINDOW_MS) / 1000.0
+        self.answers: 'OrderedDict[str, dict]' = OrderedDict()
+        self.answer_timer = None
+
+    def start(self):
+        if self.threads: return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"delivery-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        registry.gauge('z2m_delivery_queue_depth', 'Items waiting in the MQTT -> HTTP hand-off queue',
+                       lambda: [({}, self.queue.depth)])
+        registry.gauge('z2m_delivery_queue_dropped', 'Items dropped by the overflow policy', lambda: [({}, self.queue.dropped)])
+        register_channel_gauges(http_client.stats)
+        logger.info(f"Delivery pipeline: {self.workers} worker(s), queue {self.queue.maxsize}, policy {self.queue.policy}")
+
+    def submit(self, data: Any, is_list: bool, ips: Optional[list] = None) -> bool:
+        if ips is not None:
+            # targeted push (single client), no coalescing or hand-off needed
+            if is_list: http_client.send_z2mqtt_data(data, HTTP_DATA_PORT, ips)
+            else: http_client.send_device_data(data, HTTP_DEVICE_PORT, ips)
+            return True
+        if is_list: return self._put(data, True, priority_rules.device_list)
+        if isinstance(data, GetAnswers): return self._answer(data)
+        items = data if isinstance(data, list) else [data]
+        lane = priority_rules.of_items(items)
+        if self.window and lane != HIGH:
+            self._coalesce(items)
+            return True
+        if self.window:
+            # high-priority events skip the window and supersede what waits there
+            with self.coalesce_lock:
+                for item in items: self.coalesced.pop(str(item.get('avdevicename', '')), None)
+        return self._put(data, False, lane)
+
+    def _coalesce(self, items: list):
+        # latest value per avdevicename wins until the window closes
+        with self.coalesce_lock:
+            for item in items:
+                key = str(item.get('avdevicename', ''))
+                self.coalesced.pop(key, None)
+                self.coalesced[key] = item
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.window, self._flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def _flush(self):
+        with self.coalesce_lock:
+            items = list(self.coalesced.values())
+            self.coalesced.clear()
+            self.flush_timer = None
+        lanes = {}
+        for item in items: lanes.setdefault(priority_rules.of(item), []).append(item)
+        for lane, group in sorted(lanes.items()):
+            self._put(group[0] if len(group) == 1 else group, False, lane)
+
+    def _answer(self, items: list) -> bool:
+        # /get answers of a burst are gathered, then each client gets its share as one batch
+        with self.coalesce_lock:
+            for item in items:
+                key = str(item.get('avdevicename', ''))
+                # the answer is the device's latest state: it supersedes what waits in the window
+                self.coalesced.pop(key, None)
+                self.answers.pop(key, None)
+                self.answers[key] = item
+            if self.answer_timer is None:
+                self.answer_timer = threading.Timer(self.answer_window, self._flush_answers)
+                self.answer_timer.daemon = True
+                self.answer_timer.start()
+        return True
+
+    def _flush_answers(self):
+        with self.coalesce_lock:
+            items = list(self.answers.values())
+            self.answers.clear()
+            self.answer_timer = None
+        # straight to the client channels: offered together, so each drain pops them as one batch
+        if items: http_client.send_device_data(items, HTTP_DEVICE_PORT, answer=True)
+
+    def _put(self, data: Any, is_list: bool, lane: int) -> bool:
+        if not self.queue.put(data, is_list, lane):
+            logger.warning(f"Delivery queue full ({self.queue.maxsize}), update dropped")
+            return False
+        return True
+
+    def _worker(self):
+        while True:
+            key, data, is_list = self.queue.get()
+            try:
+                if is_list: http_client.send_z2mqtt_data(data, HTTP_DATA_PORT)
+                else: http_client.send_device_data(data, HTTP_DEVICE_PORT)
+            except Exception as e: logger.error(f"Delivery worker error: {e}")
+            finally: self.queue.done(key)
+
+delivery_pipeline = DeliveryPipeline()
@@ -0,0 +1,36 @@
+from typing import Any, Dict, Iterable
+from config import PRIORITY_RULES, logger
+
+HIGH, NORMAL, BULK = 0, 1, 2
+LANES = ('high', 'normal', 'bulk')
+
+# Door, motion and switch events overtake sensor reports and device lists.
+DEFAULT_RULES = {
+    'types': {'contact': 'high', 'motion': 'high', 'power_switch': 'high', 'light_dimmer': 'high', 'sensor': 'bulk'},
+    'properties': {},
+    'device_list': 'bulk',
+}
+
+def _lane(name: Any, where: str) -> int:
+    if name in LANES: return LANES.index(name)
+    logger.warning(f"Unknown priority '{name}' for {where}, using normal")
+    return NORMAL
+
+class PriorityRules:
+    def __init__(self, config: Dict[str, Any] = PRIORITY_RULES):
+        types = {**DEFAULT_RULES['types'], **config.get('types', {})}
+        properties = {**DEFAULT_RULES['properties'], **config.get('properties', {})}
+        self.types = {k: _lane(v, k) for k, v in types.items()}
+        self.properties = {k: _lane(v, k) for k, v in properties.items()}
+        self.device_list = _lane(config.get('device_list', DEFAULT_RULES['device_list']), 'device_list')
+
+    def of(self, item: dict) -> int:
+        # the most urgent property rule that applies, else the type's lane
+        lanes = [self.properties[k] for k, v in item.items() if v is not None and k in self.properties]
+        if lanes: return min(lanes)
+        return self.types.get(item.get('type'), NORMAL)
+
+    def of_items(self, items: Iterable[dict]) -> int:
+        return min((self.of(i) for i in items if isinstance(i, dict)), default=NORMAL)
+
+priority_rules = PriorityRules()
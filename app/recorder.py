@@ -0,0 +1,83 @@
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Tuple
+from config import RECORD_FILE, RECORD_MAX_MB, RECORD_KEEP, logger
+
+# File: MAGIC, then records of HEADER (wall clock, flags, topic length, payload length) + topic + payload.
+# Append-only; a torn last record (crash mid-write) is skipped on read.
+MAGIC = b'Z2MR\x01'
+HEADER = struct.Struct('<dBHI')
+FLAG_RETAIN = 1
+
+class TrafficRecorder:
+    """Appends every received MQTT message to a rotating binary log (RECORD_FILE)."""
+    def __init__(self, path: str = RECORD_FILE, max_bytes: int = int(RECORD_MAX_MB * 2 ** 20), keep: int = RECORD_KEEP):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = max(1, keep)
+        self.file = None
+        self.size = 0
+        self.flushed_at = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _open(self):
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        if self.size == 0:
+            self.file.write(MAGIC)
+            self.size = len(MAGIC)
+
+    def _rotate(self):
+        # traffic.bin -> traffic.bin.1 -> ... -> traffic.bin.<keep - 1>, oldest dropped
+        self.file.close()
+        for i in range(self.keep - 1, 0, -1):
+            src = self.path if i == 1 else f"{self.path}.{i - 1}"
+            if os.path.exists(src): os.replace(src, f"{self.path}.{i}")
+        if self.keep == 1: os.remove(self.path)
+        self._open()
+        logger.info(f"Traffic log rotated: {self.path}")
+
+    def record(self, topic: str, payload: bytes, retain: bool = False):
+        raw_topic = topic.encode('utf-8')
+        record = HEADER.pack(time.time(), FLAG_RETAIN if retain else 0, len(raw_topic), len(payload)) + raw_topic + payload
+        with self.lock:
+            try:
+                if self.file is None: self._open()
+                elif self.size + len(record) > self.max_bytes: self._rotate()
+                self.file.write(record)
+                self.size += len(record)
+                # buffered: flushed at most once a second (by the next message) and on shutdown
+                now = time.monotonic()
+                if now - self.flushed_at >= 1:
+                    self.file.flush()
+                    self.flushed_at = now
+            except Exception as e:
+                logger.error(f"Traffic recorder error, recording stopped: {e}")
+                self.path = ''
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_records(path: str) -> Iterator[Tuple[float, str, bytes, bool]]:
+    """(timestamp, topic, payload, retain) for every complete record in a traffic log."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic log")
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size: return
+            stamp, flags, topic_len, payload_len = HEADER.unpack(header)
+            body = f.read(topic_len + payload_len)
+            if len(body) < topic_len + payload_len: return
+            yield stamp, body[:topic_len].decode('utf-8'), body[topic_len:], bool(flags & FLAG_RETAIN)
+
+traffic_recorder = TrafficRecorder()
@@ -1,52 +1,57 @@
-import time
-from typing import Dict, Any
-from config import TIMEOUT_PENDING_GETREQUEST
+from typing import List
+from cache_manager import device_cache
+from config import TIMEOUT_PENDING_GETREQUEST, TIMEOUT_PENDING_STATUS, GET_ANSWER_MAX_AGE, CACHE_MAX_ENTRIES
+from expiring_cache import ExpiringCache, MISSING
+from topics import device_key
+from metrics import registry
 
 class GetResponseCache:
-    def __init__(self):
-        self.cache: Dict[str, dict] = {}
-        self.timeout = TIMEOUT_PENDING_GETREQUEST 
+    def __init__(self, timeout: float = TIMEOUT_PENDING_GETREQUEST, max_entries: int = CACHE_MAX_ENTRIES):
+        self.cache = ExpiringCache(timeout, max_entries)
+        self.timeout = timeout
             
-    def should_send(self, device_name: str, status: Any) -> bool:
-        if device_name not in self.cache: return True
-        cached = self.cache[device_name]
-        if time.time() - cached['timestamp'] > self.timeout: return True
-        return str(cached['status']) != str(status)
-    
-    def update(self, device_name: str, status: Any):
-        self.cache[device_name] = {'timestamp': time.time(), 'status': status}
+    # the whole answered item is compared: sensors have no avnewstatus, a brightness change is an answer too
+    def should_send(self, device_name: str, item: dict) -> bool:
+        return self.cache.get(device_name, MISSING) != item
+
+    def update(self, device_name: str, item: dict):
+        self.cache.set(device_name, item)
 
     def cleanup(self):
-        now = time.time()
-        expired = [k for k, v in self.cache.items() if now - v['timestamp'] > self.timeout]
-        for k in expired: del self.cache[k]
+        self.cache.expire()
 
 get_response_cache = GetResponseCache()
 
 class DeviceStatusManager:
-    def __init__(self):
-        self.pending = {} 
-    
-    def add(self, topic: str):
-        name = self._extract(topic)
-        if name: self.pending[name] = time.time()
+    def __init__(self, timeout: float = TIMEOUT_PENDING_STATUS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.pending = ExpiringCache(timeout, max_entries)
     
-    def is_pending(self, topic: str) -> bool:
-        return self._extract(topic) in self.pending
-    
-    def fulfill(self, topic: str):
+    def request(self, topic: str) -> List[dict]:
+        """Manual /get: the device's fresh known state, or [] and a wait for its reply.
+
+        A get for a device that is already waiting joins that wait (nothing new is
+        started or answered), so a polling burst costs one wait per device.
+        """
         name = self._extract(topic)
-        if name in self.pending: del self.pending[name]
+        if not name or name in self.pending: return []
+        answers = device_cache.known_state(name, GET_ANSWER_MAX_AGE)
+        if not answers: self.pending.set(name, True)
+        return answers
+
+    def take(self, topic: str) -> bool:
+        # was a manual get waiting for this report? (ends the wait)
+        if not self.pending: return False
+        return self.pending.pop(self._extract(topic), MISSING) is not MISSING
 
     def cleanup(self):
-        now = time.time()
-        expired = [k for k, v in self.pending.items() if now - v > 30]
-        for k in expired: del self.pending[k]
+        self.pending.expire()
 
     def _extract(self, topic: str) -> str:
-        parts = topic.split('/')
-        if len(parts) >= 5 and parts[4] in ['l1', 'l2']: return f"{parts[3]}/{parts[4]}"
-        return parts[3] if len(parts) >= 4 else ""
+        return device_key(topic)
 
 device_status_manager = DeviceStatusManager()
 
+registry.gauge('z2m_get_cache_entries', 'GetResponseCache entries', lambda: [({}, len(get_response_cache.cache))])
+registry.gauge('z2m_pending_gets', 'Manual /get requests waiting for a device answer',
+               lambda: [({}, len(device_status_manager.pending))])
+
@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from typing import Callable, List
+from config import WORKER_PROCESSES, STATE_SNAPSHOT_FILE, STATE_SNAPSHOT_INTERVAL, logger
+from topics import shard_key
+
+BATCH_SIZE = 64        # messages per IPC put
+FLUSH_INTERVAL = 0.002  # upper bound on the extra latency batching adds
+
+class ShardRouter:
+    """Routing, decoding and cache checks in worker processes, sharded by device.
+
+    Each worker owns the device_cache / get_response_cache / pending slice of its
+    devices, so no state is shared and nothing is locked. One FIFO inbox per
+    worker keeps per-device ordering. Device lists are broadcast to every worker
+    (their routes and allowed rooms), while the parent keeps device-list pushes,
+    the client registry and HTTP delivery.
+    """
+    def __init__(self, workers: int = WORKER_PROCESSES):
+        self.workers = workers
+        self.inboxes: List = []
+        self.outbox = None
+        self.stopping = None
+        self.processes: List[multiprocessing.Process] = []
+        self.buffers: List[list] = [[] for _ in range(max(0, workers))]
+        self.lock = threading.Lock()
+        self.buffered = threading.Condition(self.lock)
+        self.since = 0.0  # when the oldest buffered message arrived, 0 = nothing buffered
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def start(self, on_result: Callable[[object, bool], None]):
+        # on_result(data, retain), called from the result thread
+        if self.processes: return
+        ctx = multiprocessing.get_context('spawn')
+        self.outbox = ctx.Queue()
+        self.stopping = ctx.Event()
+        ready = ctx.Semaphore(0)
+        for index in range(self.workers):
+            inbox = ctx.Queue()
+            process = ctx.Process(target=_worker_main, args=(index, inbox, self.outbox, self.stopping, ready),
+                                  name=f'shard-{index}', daemon=True)
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        threading.Thread(target=self._results, args=(on_result,), name='shard-results', daemon=True).start()
+        threading.Thread(target=self._flush_loop, name='shard-flush', daemon=True).start()
+        # spawned workers take a while to import; messages queued before would wait in the inboxes
+        deadline = time.monotonic() + 30
+        for _ in range(self.workers):
+            if not ready.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                logger.warning("Worker processes not ready after 30s, routing anyway")
+                break
+        logger.info(f"Routing in {self.workers} worker processes")
+
+    def dispatch(self, topic: str, raw: bytes, retain: bool):
+        index = zlib.crc32(shard_key(topic).encode('utf-8')) % self.workers
+        with self.lock:
+            buffer = self.buffers[index]
+            buffer.append((topic, raw, retain))
+            if len(buffer) >= BATCH_SIZE: self._flush(index)
+            elif not self.since: self._wake()
+
+    def broadcast(self, topic: str, raw: bytes, retain: bool):
+        with self.lock:
+            for buffer in self.buffers: buffer.append((topic, raw, retain))
+            if not self.since: self._wake()
+
+    def _wake(self):
+        # lock held: the flush thread sleeps until something is buffered
+        self.since = time.monotonic()
+        self.buffered.notify()
+
+    def _flush(self, index: int):
+        batch, self.buffers[index] = self.buffers[index], []
+        self.inboxes[index].put(batch)
+
+    def _flush_loop(self):
+        # idle until dispatch() buffers a message, then flush once it is FLUSH_INTERVAL old
+        with self.buffered:
+            while True:
+                if not self.since:
+                    self.buffered.wait()
+                    continue
+                delay = self.since + FLUSH_INTERVAL - time.monotonic()
+                if delay > 0:
+                    self.buffered.wait(delay)
+                    continue
+                for index, buffer in enumerate(self.buffers):
+                    if buffer: self._flush(index)
+                self.since = 0.0
+
+    def _results(self, on_result):
+        while True:
+            for data, retain in self.outbox.get():
+                try: on_result(data, retain)
+                except Exception as e: logger.error(f"Shard result error: {e}")
+
+    def stop(self, timeout: float = 5):
+        # runs in a signal handler: the interrupted thread may hold the lock (or a queue's), so
+        # buffered messages are flushed only if that is safe and workers are stopped through an event
+        if not self.processes: return
+        if self.lock.acquire(timeout=1):
+            try:
+                for index, buffer in enumerate(self.buffers):
+                    if buffer: self._flush(index)
+            finally: self.lock.release()
+        self.stopping.set()
+        for process in self.processes: process.join(timeout)
+
+def _worker_main(index: int, inbox, outbox, stopping, ready):
+    # the parent coordinates shutdown (stopping); a group-wide SIGINT is its business,
+    # SIGTERM (Process.terminate, timeout) finishes the current batch and saves first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+    parent = os.getppid()
+    from cache_manager import device_cache
+    from codec import loads
+    from message_router import release_held, route_message
+    from services import device_status_manager, get_response_cache
+    from snapshot import StateSnapshot
+    snapshot = StateSnapshot(f"{STATE_SNAPSHOT_FILE}.{index}" if STATE_SNAPSHOT_FILE else '')
+    snapshot.load()
+    ready.release()
+    last_save = last_cleanup = time.monotonic()
+    while True:
+        try: batch = inbox.get(timeout=1)
+        except queue.Empty:
+            # drained after stop(), or the parent was killed without it
+            if stopping.is_set() or os.getppid() != parent: break
+            batch = []
+        if terminated: break
+        results = []
+        for topic, raw, retain in batch:
+            try:
+                data, is_list = route_message(topic, loads(raw) if raw else {})
+                # device lists are pushed by the parent
+                if data and not is_list: results.append((data, retain))
+            except Exception as e: logger.error(f"Shard {index} handler error: {e}")
+        # changes held back by a min_interval; an idle worker still wakes every second for these
+        try:
+            data = release_held()
+            if data: results.append((data, False))
+        except Exception as e: logger.error(f"Shard {index} release error: {e}")
+        if results: outbox.put(results)
+        now = time.monotonic()
+        if now - last_cleanup >= 300:
+            device_cache.cleanup()
+            device_status_manager.cleanup()
+            get_response_cache.cleanup()
+            last_cleanup = now
+        if snapshot.enabled and now - last_save >= STATE_SNAPSHOT_INTERVAL:
+            snapshot.save()
+            last_save = now
+    snapshot.save()
+
+shard_router = ShardRouter()
@@ -0,0 +1,65 @@
+import gzip
+import json
+import os
+import threading
+import time
+from cache_manager import device_cache
+from config import STATE_SNAPSHOT_FILE, STATE_SNAPSHOT_INTERVAL, logger
+from device_list_processor import export_fingerprints, restore_fingerprints
+
+SNAPSHOT_VERSION = 1
+
+class StateSnapshot:
+    """Warm restart: DeviceStatusCache and device-list fingerprints as gzipped JSON on disk."""
+    def __init__(self, path: str = STATE_SNAPSHOT_FILE, interval: float = STATE_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self) -> bool:
+        if not self.enabled or not os.path.exists(self.path): return False
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                logger.warning(f"Snapshot {self.path} has unknown version, ignored")
+                return False
+            elapsed = max(0.0, time.time() - snapshot['saved_at'])
+            restored = device_cache.restore(snapshot.get('devices', {}), elapsed)
+            restore_fingerprints(snapshot.get('device_lists', {}))
+            logger.info(f"Snapshot loaded: {restored} device(s), {elapsed:.0f}s old")
+            return True
+        except Exception as e:
+            logger.error(f"Error loading snapshot {self.path}: {e}")
+            return False
+
+    def save(self):
+        if not self.enabled: return
+        tmp = f"{self.path}.tmp"
+        try:
+            # the caches keep changing on other threads: a failed export only skips this save
+            snapshot = {'version': SNAPSHOT_VERSION, 'saved_at': time.time(),
+                        'devices': device_cache.export(), 'device_lists': export_fingerprints()}
+            with self.lock:
+                with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+                    json.dump(snapshot, f, separators=(',', ':'), default=str)
+                os.replace(tmp, self.path)
+            logger.debug(f"Snapshot saved: {len(snapshot['devices'])} device(s)")
+        except Exception as e:
+            logger.error(f"Error saving snapshot {self.path}: {e}")
+
+    def start(self):
+        if not self.enabled: return
+        threading.Thread(target=self._loop, name='snapshot', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try: self.save()
+            except Exception as e: logger.error(f"Snapshot error: {e}")
+
+state_snapshot = StateSnapshot()
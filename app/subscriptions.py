@@ -0,0 +1,77 @@
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from client_manager import ClientSnapshot, Scope, client_manager
+from codec import Payload
+from device_list_processor import trim_device_list
+
+class ScopeIndex:
+    """Room / type / device -> interested client IPs for one ClientSnapshot."""
+    def __init__(self, snapshot: ClientSnapshot):
+        self.version = snapshot.version
+        self.ips = snapshot.ips
+        scoped: Dict[str, List[Scope]] = {}
+        unscoped = set()
+        for name, ip in snapshot.clients.items():
+            scope = snapshot.scopes.get(name)
+            if scope is None: unscoped.add(ip)
+            else: scoped.setdefault(ip, []).append(scope)
+        # an IP registered under an unscoped name as well gets everything
+        self.scopes: Dict[str, Tuple[Scope, ...]] = {ip: tuple(s) for ip, s in scoped.items() if ip not in unscoped}
+        self.everyone = frozenset(ip for ip in self.ips if ip not in self.scopes)
+        self.matches: Dict[tuple, FrozenSet[str]] = {}
+
+    def ips_for(self, room, dtype, device: str) -> FrozenSet[str]:
+        key = (room, dtype, device)
+        ips = self.matches.get(key)
+        if ips is None:
+            ips = self.matches[key] = self.everyone | {ip for ip, scopes in self.scopes.items()
+                                                      if any(s.matches(room, dtype, device) for s in scopes)}
+        return ips
+
+class SubscriptionIndex:
+    """Fan-out by per-client subscription; rebuilt lazily when the client registry changes."""
+    def __init__(self, manager=client_manager):
+        self.manager = manager
+        self.index: Optional[ScopeIndex] = None
+
+    def current(self) -> ScopeIndex:
+        index, snapshot = self.index, self.manager.snapshot
+        if index is None or index.version != snapshot.version:
+            index = self.index = ScopeIndex(snapshot)
+        return index
+
+    def fan_out(self, entries: List[tuple], ips: Optional[List[str]] = None) -> List[Tuple[str, List[tuple]]]:
+        """(ip, entries) per target client. Entries are (key, (port, Payload, is_list)); device
+        lists are trimmed to each client's scope, one trimmed Payload per distinct scope."""
+        index = self.current()
+        targets = index.ips if ips is None else ips
+        if not index.scopes: return [(ip, entries) for ip in targets]
+        per_ip: Dict[str, List[tuple]] = {ip: [] for ip in targets}
+        trimmed: Dict[tuple, Payload] = {}
+        for key, (port, payload, is_list) in entries:
+            if is_list:
+                for ip, mine in per_ip.items():
+                    scopes = index.scopes.get(ip)
+                    if scopes is None:
+                        mine.append((key, (port, payload, True)))
+                        continue
+                    part = trimmed.get(scopes)
+                    if part is None:
+                        part = trimmed[scopes] = Payload(trim_device_list(payload.data, lambda d: _list_match(scopes, d)), payload.lane)
+                    mine.append((key, (port, part, True)))
+            else:
+                item = payload.data
+                allowed = index.ips_for(item.get('room'), item.get('type'), str(item.get('avdevicename', '')).split('/')[0])
+                for ip, mine in per_ip.items():
+                    if ip in allowed: mine.append((key, (port, payload, False)))
+        return [(ip, mine) for ip, mine in per_ip.items() if mine]
+
+def _list_match(scopes: Tuple[Scope, ...], dev_data: dict) -> bool:
+    # list entries are matched by the event types of the device (event_types), like its events
+    # ns:base/room/device -> ns:device, the avdevicename events of the same device carry
+    name = str(dev_data.get('name', ''))
+    ns, _, _ = name.partition('/')[0].rpartition(':')
+    device = f"{ns}:{name.split('/', 2)[-1]}" if ns else name.split('/', 2)[-1]
+    types = dev_data.get('event_types') or [None]
+    return any(s.matches(dev_data.get('room'), t, device) for s in scopes for t in types)
+
+subscription_index = SubscriptionIndex()
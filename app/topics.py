@@ -0,0 +1,38 @@
+from functools import lru_cache
+from typing import Tuple
+
+@lru_cache(maxsize=4096)
+def split_topic(topic: str) -> Tuple[str, ...]:
+    # topics repeat endlessly, parse each one once
+    return tuple(topic.split('/'))
+
+@lru_cache(maxsize=4096)
+def namespace(topic: str) -> str:
+    # ns@base/... -> ns (topics of a namespaced bridge, see MQTTHandler)
+    head = split_topic(topic)[0]
+    return head.split('@', 1)[0] if '@' in head else ''
+
+def is_device_list(topic: str) -> bool:
+    return topic.endswith('bridge/devices')
+
+@lru_cache(maxsize=4096)
+def is_relevant(topic: str) -> bool:
+    # cheap check before decoding: commands, availability and bridge topics other than the device list are never routed
+    parts = split_topic(topic)
+    if parts[-1] in ('set', 'availability') or (len(parts) > 1 and parts[-2] == 'set'): return False
+    return len(parts) < 2 or parts[1] != 'bridge' or is_device_list(topic)
+
+@lru_cache(maxsize=4096)
+def shard_key(topic: str) -> str:
+    # the device part only, so /get, /set and the /l1 /l2 endpoints of a device share a worker
+    parts = split_topic(topic)
+    return parts[3] if len(parts) >= 4 else topic
+
+@lru_cache(maxsize=4096)
+def device_key(topic: str) -> str:
+    # base/x/room/device[/l1|/l2][/get] -> device or device/l1
+    parts = split_topic(topic)
+    ns = namespace(topic)
+    prefix = f"{ns}:" if ns else ''
+    if len(parts) >= 5 and parts[4] in ('l1', 'l2'): return f"{prefix}{parts[3]}/{parts[4]}"
+    return f"{prefix}{parts[3]}" if len(parts) >= 4 else ""
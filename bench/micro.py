@@ -0,0 +1,58 @@
+"""Micro-benchmarks for the routing hot path.
+
+    python bench/micro.py [--devices 300] [--number 20000]
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('CLIENTS_DATA_FILE', os.devnull)
+
+from traffic import bridge_devices_payload, make_devices, state_payload
+
+def bench(label: str, fn, number: int):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{label:>42}: {best / number * 1e6:9.2f} us/call")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=300)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    from cache_manager import DeviceStatusCache
+    from device_list_processor import process_device_list
+    from message_router import route_message
+
+    rng = random.Random(0)
+    devices = make_devices(args.devices, args.rooms)
+    device_list = bridge_devices_payload(devices)
+    messages = [(f"gtl/{d['friendly_name']}", state_payload(d, rng)) for d in devices for _ in range(10)]
+    rng.shuffle(messages)
+
+    # device list: first (cold) build, then the unchanged republish path
+    cold = iter([copy.deepcopy(device_list) for _ in range(5 * 3)])
+    bench(f"process_device_list cold ({args.devices} dev)", lambda: process_device_list(next(cold), f"bench{rng.random()}/bridge/devices"), 3)
+    process_device_list(device_list, 'gtl/bridge/devices')
+    bench(f"process_device_list unchanged ({args.devices} dev)", lambda: process_device_list(device_list, 'gtl/bridge/devices'), 20)
+
+    it = iter(messages * (args.number * 5 // len(messages) + 1))
+    bench('route_message (registry, mixed)', lambda: route_message(*next(it)), args.number)
+
+    cache = DeviceStatusCache()
+    item = {'room': 'nappali', 'avdevicename': 'temp1', 'type': 'sensor', 'temperature': 21.3, 'humidity': 45.0, 'battery': 90}
+    cache.update('temp1', item)
+    probe = dict(item, temperature=21.4)
+    bench('should_filter_message (hit, filtered)', lambda: cache.should_filter_message('temp1', probe), args.number)
+    bench('should_filter_message (miss)', lambda: cache.should_filter_message('nope', probe), args.number)
+
+if __name__ == '__main__':
+    main()
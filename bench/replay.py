@@ -0,0 +1,103 @@
+"""Replay a recorded traffic log (RECORD_FILE) through routing and delivery into stub receivers.
+
+    python bench/replay.py data/traffic.bin.1 data/traffic.bin              # real time
+    python bench/replay.py data/traffic.bin --speed 10                      # 10x
+    python bench/replay.py data/traffic.bin --speed 0 --clients 3 --json    # as fast as possible
+
+Rotated logs are replayed in the order given, so list the oldest first. Messages
+go straight into MQTTHandler.on_message (threads runtime, no broker). Client
+registrations and subscriptions in the log are skipped: the bridge only knows the stub receivers
+(127.0.0.2.. on --device-port/--data-port), so nothing reaches the real phones.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+from run_bench import FakeMessage
+from stub_receivers import StubReceiver
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', help='traffic log file(s), oldest first')
+    parser.add_argument('--speed', type=float, default=1.0, help='time scale, 0 = as fast as possible')
+    parser.add_argument('--clients', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--device-port', type=int, default=18905)
+    parser.add_argument('--data-port', type=int, default=18904)
+    parser.add_argument('--drain', type=float, default=3, help='seconds to wait for deliveries after the last message')
+    parser.add_argument('--top', type=int, default=10, help='busiest devices to list in the report')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    ips = [f"127.0.0.{i + 2}" for i in range(args.clients)]
+    receivers = [StubReceiver(ip, [args.device_port, args.data_port], args.latency_ms / 1000.0, args.failure_rate, i)
+                 for i, ip in enumerate(ips)]
+    for r in receivers: r.start()
+
+    clients_file = os.path.join(tempfile.mkdtemp(prefix='z2replay'), 'clients.json')
+    with open(clients_file, 'w') as f:
+        json.dump({f"replay{i}": ip for i, ip in enumerate(ips)}, f)
+    os.environ['CLIENTS_DATA_FILE'] = clients_file
+    os.environ['RECORD_FILE'] = ''
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['HTTP_DEVICE_PORT'] = str(args.device_port)
+    os.environ['HTTP_DATA_PORT'] = str(args.data_port)
+    from mqtt_handler import MQTTHandler
+    from pipeline import delivery_pipeline
+    from recorder import read_records
+    delivery_pipeline.start()
+    handler = MQTTHandler()
+
+    replayed, skipped, first_stamp, last_stamp = 0, 0, None, None
+    topics = Counter()
+    start = time.perf_counter()
+    for path in args.logs:
+        for stamp, topic, payload, retain in read_records(path):
+            if topic.startswith('client/'):
+                skipped += 1
+                continue
+            if first_stamp is None: first_stamp = stamp
+            last_stamp = stamp
+            if args.speed:
+                delay = start + (stamp - first_stamp) / args.speed - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+            handler.on_message(handler.client, None, FakeMessage(topic, payload, retain))
+            topics[topic] += 1
+            replayed += 1
+    replay_time = time.perf_counter() - start
+    time.sleep(args.drain)
+
+    delivered = Counter()
+    for r in receivers:
+        for name, times in r.received.items(): delivered[name] += len(times)
+    report = {
+        'messages': replayed,
+        'registrations_skipped': skipped,
+        'recorded_seconds': round(last_stamp - first_stamp, 3) if replayed else 0,
+        'replay_seconds': round(replay_time, 3),
+        'throughput_msg_s': round(replayed / replay_time, 1) if replay_time else 0,
+        'outbound_requests': sum(r.requests for r in receivers),
+        'failed_requests': sum(r.failures for r in receivers),
+        'device_updates_delivered': sum(r.updates() for r in receivers),
+        'device_list_pushes': sum(r.device_lists for r in receivers),
+        'bytes_received': sum(r.bytes_in for r in receivers),
+        'busiest_topics': dict(topics.most_common(args.top)),
+        'most_delivered_devices': dict(delivered.most_common(args.top)),
+    }
+    if args.json: print(json.dumps(report))
+    else:
+        for key, value in report.items(): print(f"{key:>26}: {value}")
+    for r in receivers: r.stop()
+
+if __name__ == '__main__':
+    main()
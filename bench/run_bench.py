@@ -0,0 +1,158 @@
+"""End-to-end benchmark: synthetic traffic -> bridge -> stub HTTP receivers.
+
+    python bench/run_bench.py --devices 200 --rooms 10 --rate 200 --duration 10 --burst-every 2 --burst-size 30
+    python bench/run_bench.py --clients 4 --latency-ms 50 --failure-rate 0.05
+
+By default messages are injected straight into MQTTHandler.on_message (threads
+runtime, no broker needed). With --broker host:port they are published to a
+broker instead and the bridge is expected to run separately, pointed at the
+stub receivers (127.0.0.2.. on --device-port/--data-port).
+
+Latency is measured per device, from the latest injected message to the
+delivery that follows it, so coalesced updates count once. Throughput is end to
+end: messages over the time from the first injection to the last delivery
+(ingest_msg_s is only how fast this process accepted them).
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from traffic import bridge_devices_payload, make_devices, traffic
+from stub_receivers import StubReceiver
+
+class FakeMessage:
+    __slots__ = ('topic', 'payload', 'retain')
+
+    def __init__(self, topic: str, payload: bytes, retain: bool = False):
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=100, help='steady state messages per second')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--burst-every', type=float, default=0, help='scene burst interval (s)')
+    parser.add_argument('--burst-size', type=int, default=0, help='lights switched per burst')
+    parser.add_argument('--speed', type=float, default=1.0, help='time scale, 0 = as fast as possible')
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--device-port', type=int, default=18905)
+    parser.add_argument('--data-port', type=int, default=18904)
+    parser.add_argument('--drain', type=float, default=3, help='seconds to wait for deliveries after the last message')
+    parser.add_argument('--workers', type=int, default=0, help='route in N worker processes (WORKER_PROCESSES)')
+    parser.add_argument('--broker', default='', help='host:port, publish instead of in-process injection')
+    parser.add_argument('--tracemalloc', action='store_true', help='report peak Python heap (slower)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    ips = [f"127.0.0.{i + 2}" for i in range(args.clients)]
+    receivers = [StubReceiver(ip, [args.device_port, args.data_port], args.latency_ms / 1000.0, args.failure_rate, args.seed + i)
+                 for i, ip in enumerate(ips)]
+    for r in receivers: r.start()
+
+    devices = make_devices(args.devices, args.rooms, args.seed)
+    device_list = bridge_devices_payload(devices)
+    schedule = list(traffic(devices, args.rate, args.duration, args.burst_every, args.burst_size, seed=args.seed))
+
+    shards = None
+    if args.broker:
+        import paho.mqtt.client as mqtt
+        host, _, port = args.broker.partition(':')
+        client = mqtt.Client()
+        client.connect(host, int(port or 1883))
+        client.loop_start()
+        for i, ip in enumerate(ips):
+            client.publish('client/con_ip', f"bench{i}/{ip}")
+        publish = lambda topic, body: client.publish(topic, body)
+    else:
+        clients_file = os.path.join(tempfile.mkdtemp(prefix='z2bench'), 'clients.json')
+        with open(clients_file, 'w') as f:
+            json.dump({f"bench{i}": ip for i, ip in enumerate(ips)}, f)
+        os.environ['CLIENTS_DATA_FILE'] = clients_file
+        os.environ['RECORD_FILE'] = ''
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ['HTTP_DEVICE_PORT'] = str(args.device_port)
+        os.environ['HTTP_DATA_PORT'] = str(args.data_port)
+        sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+        from mqtt_handler import MQTTHandler
+        from pipeline import delivery_pipeline
+        from sharding import ShardRouter
+        delivery_pipeline.start()
+        shards = ShardRouter(args.workers) if args.workers > 1 else None
+        handler = MQTTHandler(shards=shards)
+        if shards: shards.start(lambda data, retain: handler.deliver(data, False, retain))
+        publish = lambda topic, body: handler.on_message(handler.client, None, FakeMessage(topic, body))
+
+    if args.tracemalloc: tracemalloc.start()
+    publish('gtl/bridge/devices', json.dumps(device_list).encode())
+    time.sleep(0.2)
+
+    injected = {}
+    encoded = [(offset, topic, json.dumps(payload).encode()) for offset, topic, payload in schedule]
+    start = time.perf_counter()
+    for offset, topic, body in encoded:
+        if args.speed:
+            delay = start + offset / args.speed - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+        injected.setdefault(topic.split('/')[-1], []).append(time.perf_counter())
+        publish(topic, body)
+    ingest_time = time.perf_counter() - start
+    time.sleep(args.drain)
+
+    latencies, last_delivery = [], start
+    for r in receivers:
+        for name, times in r.received.items():
+            last_delivery = max([last_delivery] + times)
+            sent = injected.get(name, [])
+            i = 0
+            for received in times:
+                while i + 1 < len(sent) and sent[i + 1] <= received: i += 1
+                if sent and sent[i] <= received: latencies.append(received - sent[i])
+
+    report = {
+        'messages': len(encoded),
+        'ingest_seconds': round(ingest_time, 3),
+        'ingest_msg_s': round(len(encoded) / ingest_time, 1) if ingest_time else 0,
+        'delivered_seconds': round(last_delivery - start, 3),
+        'throughput_msg_s': round(len(encoded) / (last_delivery - start), 1) if last_delivery > start else 0,
+        'outbound_requests': sum(r.requests for r in receivers),
+        'failed_requests': sum(r.failures for r in receivers),
+        'device_updates_delivered': sum(r.updates() for r in receivers),
+        'device_list_pushes': sum(r.device_lists for r in receivers),
+        'bytes_received': sum(r.bytes_in for r in receivers),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'latency_mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else 0,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if args.tracemalloc:
+        report['peak_heap_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+
+    if args.json: print(json.dumps(report))
+    else:
+        for key, value in report.items(): print(f"{key:>26}: {value}")
+    for r in receivers: r.stop()
+    if shards: shards.stop()
+
+if __name__ == '__main__':
+    main()
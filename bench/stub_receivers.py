@@ -0,0 +1,90 @@
+"""Local stand-ins for the phones: HTTP receivers on HTTP_DEVICE_PORT / HTTP_DATA_PORT."""
+import gzip
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+class StubReceiver:
+    """One simulated client (own loopback IP) with configurable latency and failure rate.
+
+    Failures are answered by dropping the connection, which the bridge sees as an
+    unreachable client. Every response advertises gzip request bodies, and
+    gzipped bodies are counted in bytes_in as they came over the wire.
+    """
+    def __init__(self, ip: str, ports: List[int], latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.ip = ip
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self.device_lists = 0
+        self.bytes_in = 0
+        self.received: Dict[str, List[float]] = defaultdict(list)
+        self.lock = threading.Lock()
+        self.servers = [ThreadingHTTPServer((ip, port), self._handler()) for port in ports]
+        for server in self.servers:
+            server.daemon_threads = True
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with receiver.lock: receiver.bytes_in += len(body)
+                if body and self.headers.get('Content-Encoding') == 'gzip': body = gzip.decompress(body)
+                if receiver.latency: time.sleep(receiver.latency)
+                with receiver.lock:
+                    receiver.requests += 1
+                    if receiver.rng.random() < receiver.failure_rate:
+                        receiver.failures += 1
+                        self.close_connection = True
+                        return
+                receiver.record(self.path, body)
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.send_header('Accept-Encoding', 'gzip')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def record(self, path: str, body: bytes):
+        now = time.perf_counter()
+        names = []
+        query = parse_qs(urlsplit(path).query)
+        if 'avdevicename' in query:
+            names = query['avdevicename']
+        elif body:
+            data = json.loads(body)
+            if 'updates' in data:
+                names = [u.get('avdevicename', '') for u in data['updates']]
+            else:
+                with self.lock: self.device_lists += 1
+        with self.lock:
+            for name in names:
+                self.received[name.split('/')[0]].append(now)
+
+    def start(self):
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def updates(self) -> int:
+        with self.lock:
+            return sum(len(v) for v in self.received.values())
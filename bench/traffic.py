@@ -0,0 +1,75 @@
+"""Synthetic Zigbee2MQTT traffic: bridge/devices payloads and gtl/<room>/<device> state messages."""
+import random
+from typing import Dict, Iterator, List, Tuple
+
+KINDS = ('dimmer', 'switch', 'dual_dimmer', 'temperature', 'contact', 'motion')
+ROOMS = ('nappali', 'konyha', 'haloszoba', 'furdo', 'eloszoba', 'dolgozo', 'gyerekszoba', 'garazs', 'kert', 'pince')
+
+_EXPOSES = {
+    'dimmer': [{'type': 'light', 'features': [{'property': 'state'}, {'property': 'brightness'}]}],
+    'switch': [{'type': 'switch', 'features': [{'property': 'state'}]}, {'property': 'power'}],
+    'dual_dimmer': [{'type': 'light', 'endpoint': ep, 'features': [{'property': f'state_{ep}', 'name': 'state'},
+                                                                      {'property': f'brightness_{ep}', 'name': 'brightness'}]}
+                    for ep in ('l1', 'l2')],
+    'temperature': [{'property': 'temperature'}, {'property': 'humidity'}, {'property': 'battery'}],
+    'contact': [{'property': 'contact'}, {'property': 'battery'}],
+    'motion': [{'property': 'occupancy'}, {'property': 'battery'}, {'property': 'voltage'}],
+}
+
+def make_devices(n_devices: int, n_rooms: int, seed: int = 0) -> List[Dict[str, str]]:
+    rng = random.Random(seed)
+    rooms = [ROOMS[i] if i < len(ROOMS) else f"room{i}" for i in range(max(1, n_rooms))]
+    devices = []
+    for i in range(n_devices):
+        kind = rng.choice(KINDS)
+        room = rooms[i % len(rooms)]
+        name = f"{kind}{i}"
+        devices.append({'kind': kind, 'room': room, 'name': name, 'friendly_name': f"gtl/{room}/{name}"})
+    return devices
+
+def bridge_devices_payload(devices: List[Dict[str, str]]) -> list:
+    payload = [{'friendly_name': 'Coordinator', 'type': 'Coordinator', 'supported': True}]
+    for i, d in enumerate(devices):
+        payload.append({
+            'ieee_address': f"0x{i:016x}", 'friendly_name': d['friendly_name'], 'supported': True,
+            'type': 'EndDevice' if d['kind'] in ('temperature', 'contact', 'motion') else 'Router',
+            'definition': {'model': d['kind'], 'vendor': 'bench', 'exposes': _EXPOSES[d['kind']]},
+        })
+    return payload
+
+def state_payload(device: Dict[str, str], rng: random.Random) -> dict:
+    kind = device['kind']
+    if kind == 'dimmer':
+        return {'state': rng.choice(('ON', 'OFF')), 'brightness': rng.randint(1, 254), 'linkquality': rng.randint(20, 200)}
+    if kind == 'switch':
+        return {'state': rng.choice(('ON', 'OFF')), 'power': round(rng.uniform(0, 2000), 1)}
+    if kind == 'dual_dimmer':
+        return {'state_l1': rng.choice(('ON', 'OFF')), 'brightness_l1': rng.randint(1, 254),
+                'state_l2': rng.choice(('ON', 'OFF')), 'brightness_l2': rng.randint(1, 254)}
+    if kind == 'temperature':
+        return {'temperature': round(rng.uniform(18, 26), 2), 'humidity': round(rng.uniform(30, 70), 1),
+                'battery': rng.randint(50, 100)}
+    if kind == 'contact':
+        return {'contact': rng.random() < 0.5, 'battery': rng.randint(50, 100)}
+    return {'occupancy': rng.random() < 0.5, 'battery': rng.randint(50, 100), 'voltage': rng.randint(2800, 3100)}
+
+def traffic(devices: List[Dict[str, str]], rate: float, duration: float, burst_every: float = 0,
+            burst_size: int = 0, base: str = 'gtl', seed: int = 0) -> Iterator[Tuple[float, str, dict]]:
+    """(offset seconds, topic, payload): steady Poisson traffic at `rate` msg/s plus optional scene bursts
+    (`burst_size` lights switched at the same instant every `burst_every` seconds)."""
+    rng = random.Random(seed)
+    lights = [d for d in devices if d['kind'] in ('dimmer', 'switch', 'dual_dimmer')] or devices
+    events = []
+    t = 0.0
+    while rate > 0:
+        t += rng.expovariate(rate)
+        if t >= duration: break
+        events.append((t, rng.choice(devices)))
+    if burst_every and burst_size:
+        t = burst_every
+        while t < duration:
+            events.extend((t, d) for d in rng.sample(lights, min(burst_size, len(lights))))
+            t += burst_every
+    events.sort(key=lambda e: e[0])
+    for offset, device in events:
+        yield offset, f"{base}/{device['friendly_name']}", state_payload(device, rng)